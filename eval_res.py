@@ -141,11 +141,16 @@ def eval(opt):
 
 def candidate_eval(opt, gt_path):
     import torch
-    from models.squeezenet import SqueezeNetFeature
-    from lib.candidate_extracting import candidate_extraction
 
-    device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
-    model = SqueezeNetFeature().cuda(device)
+    # histogram : no CNN, models.squeezenet (torchvision) is not imported
+    if opt.candidate_method == 'histogram':
+        from lib.histogram_candidate import histogram_candidate_extraction
+    else:
+        from models.squeezenet import SqueezeNetFeature
+        from lib.candidate_extracting import candidate_extraction
+
+        device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+        model = SqueezeNetFeature().cuda(device)
     root_dir = os.path.join(opt.root_dir, opt.test_subdir)
     # print(root_dir, flush=True)
     # print(opt.test_list_path, flush=True)
@@ -160,7 +165,20 @@ def candidate_eval(opt, gt_path):
     for idx, videoname in enumerate(video_name_list):
         print("Process {} {}".format(idx + 1, videoname), flush=True)
         result[videoname] = {}
-        boundary_index_list = candidate_extraction(root_dir, videoname, model, adjacent=True)
+        if opt.candidate_method == 'histogram':
+            boundary_index_list = histogram_candidate_extraction(
+                root_dir, videoname, gts[videoname]['frame_num'], distance_threshold=opt.cascade_threshold,
+                block_size=opt.candidate_block_size,
+                cache_dir=opt.feature_cache_dir if opt.feature_cache_dir else None, frame_step=opt.candidate_step)
+        else:
+            boundary_index_list = candidate_extraction(
+                root_dir, videoname, gts[videoname]['frame_num'], model,
+                adjacent=True, streaming=opt.candidate_streaming,
+                block_size=opt.candidate_block_size,
+                batch_size=opt.candidate_batch_size,
+                pca_mode=opt.candidate_pca, pca_path=opt.candidate_pca_path,
+                cache_dir=opt.feature_cache_dir if opt.feature_cache_dir else None,
+                distance_threshold=opt.cascade_threshold, decode_size=opt.decode_size)
         labels = gts[videoname]["transitions"]
         total_length = len(labels)
         count_included = 0
@@ -185,10 +203,50 @@ def candidate_eval(opt, gt_path):
     return result
 
 
+def cascade_calibration(opt, gt_path):
+    """cascade_threshold which keeps opt.cascade_recall of the transitions of the videos in opt.test_list_path,
+    and the ratio of test windows the detector still classifies with it
+    """
+    import numpy as np
+    from lib.cascade import CandidateStage, candidate_windows, transition_scores, calibrate_threshold, boundary_recall
+
+    stage = CandidateStage(opt)
+    root_dir = os.path.join(opt.root_dir, opt.test_subdir)
+    with open(opt.test_list_path, 'r') as f:
+        video_name_list = [line.strip('\n') for line in f.readlines()]
+
+    gts = json.load(open(gt_path))
+    distances, scores = dict(), list()
+    for idx, videoname in enumerate(video_name_list):
+        print("Process {} {}".format(idx + 1, videoname), flush=True)
+        _, distances[videoname] = stage.boundaries(root_dir, videoname, gts[videoname]['frame_num'],
+                                                   return_distances=True)
+        scores.append(transition_scores(distances[videoname], gts[videoname]["transitions"], opt.cascade_margin))
+    threshold = calibrate_threshold(np.concatenate(scores), opt.cascade_recall)
+    if threshold is None:
+        print('[INFO] no transition to calibrate on', flush=True)
+        return None
+
+    result = {'threshold': threshold, 'recall': dict()}
+    windows, kept = 0, 0
+    for videoname in video_name_list:
+        boundary_index = np.flatnonzero(distances[videoname] > threshold)
+        num_windows = max(gts[videoname]['frame_num'] // (opt.sample_duration // 2) - 1, 0)
+        windows += num_windows
+        kept += candidate_windows(boundary_index, num_windows, opt.sample_duration, opt.cascade_margin).shape[0]
+        result['recall'][videoname] = boundary_recall(boundary_index, gts[videoname]["transitions"],
+                                                      opt.cascade_margin)
+    result['window_ratio'] = kept / windows if windows != 0 else 0.
+    print('[INFO] cascade_threshold {:.4f} : recall {:.4f}, {}/{} windows ({:.3f})'.format(
+        threshold, np.mean(list(result['recall'].values())), kept, windows, result['window_ratio']), flush=True)
+    return result
+
+
 if __name__ == "__main__":
     opt = parse_opts()
     check_gt = False
     check_candidate = False
+    check_cascade = False
     if check_gt:
         out_path = os.path.join(opt.result_dir, 'results.json')
         eval(out_path,opt.gt_dir)
@@ -203,3 +261,5 @@ if __name__ == "__main__":
             for _, value in result.items():
                 total += value
             print(total / len(result.keys()))
+    elif check_cascade:
+        json.dump(cascade_calibration(opt, opt.gt_dir), open('cascade_calibration.json', 'w'), indent=2)
@@ -1 +1,3 @@
-__all__ = ['candidate_extracting', 'spatial_transforms', 'utils']
+__all__ = ['candidate_extracting', 'cascade', 'clip_builder', 'feature_cache', 'frame_store', 'histogram_candidate',
+           'inference', 'merge_policy', 'spatial_transforms', 'utils', 'video_prefetch',
+           'video_reader']
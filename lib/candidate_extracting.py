@@ -1,38 +1,220 @@
-from scipy.spatial.distance import cosine
-from sklearn.decomposition import PCA
-import cv2
+from sklearn.decomposition import PCA, IncrementalPCA
 import os
 import pickle
 import matplotlib.pyplot as plt
 import scipy
 import sys
 import json
+import time
 
 from models.squeezenet import SqueezeNetFeature
 from lib.spatial_transforms import *
-
-
-def candidate_extraction(root_dir, video_file, total_frame, model, adjacent=True):
+from lib.feature_cache import FeatureCache, file_hash
+from lib.video_reader import VideoReader
+
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+def read_video_frames(video_dir, total_frame, size=None):
+    """Decode a video frame by frame.
+    Frames are yielded as soon as they are decoded (BGR numpy arrays from cv2),
+    so the caller never has to keep the whole video in memory.
+    With size (width, height), frames are resized right after decoding.
+    """
+    return iter(VideoReader(video_dir, size=size, end=total_frame if total_frame else None))
+
+
+def frame_blocks(frames, block_size):
+    """Group a frame generator into lists of at most block_size frames"""
+    block = list()
+    for frame in frames:
+        block.append(frame)
+        if len(block) == block_size:
+            yield block
+            block = list()
+    if len(block) != 0:
+        yield block
+
+
+def extract_frame_feature(model, im):
+    # im_np = np.array(im) # cv2 always return numpy array
+    im = Image.fromarray(im).resize((128, 128))
+    frame = np.array(im)
+
+    frame_tensor = torch.from_numpy(frame).transpose(0, 1).transpose(0, 2).unsqueeze(0).float()
+    frame_tensor = frame_tensor.to(device, non_blocking=True)
+    frame_feature_tensor = model(frame_tensor).cpu()
+    return frame_feature_tensor.squeeze(0).data.numpy()
+
+
+def extract_frame_features(model, frames, batch_size=32):
+    """Batched version of extract_frame_feature.
+    Frames are resized and stacked into one [batch_size, 3, 128, 128] tensor
+    and the backbone is run once per batch.
+    Returns numpy array [len(frames), 512, 7, 7]
+    """
+    features = list()
+    with torch.no_grad():
+        for start in range(0, len(frames), batch_size):
+            batch = np.stack([np.array(Image.fromarray(im).resize((128, 128)))
+                              for im in frames[start:start + batch_size]])
+            batch_tensor = torch.from_numpy(batch).permute(0, 3, 1, 2).float()
+            batch_tensor = batch_tensor.to(device, non_blocking=True)
+            features.append(model(batch_tensor).cpu().numpy())
+
+    return np.concatenate(features, 0)
+
+
+def benchmark_feature_extraction(model, frames, batch_sizes=(1, 8, 32, 64)):
+    """Compare frames/sec of the per-frame loop and the batched extraction"""
+    result = dict()
+    start_time = time.time()
+    with torch.no_grad():
+        for im in frames:
+            extract_frame_feature(model, im)
+    result['per_frame'] = len(frames) / (time.time() - start_time)
+    print('per-frame loop : {:.1f} frames/sec'.format(result['per_frame']), flush=True)
+
+    for batch_size in batch_sizes:
+        start_time = time.time()
+        extract_frame_features(model, frames, batch_size=batch_size)
+        result[batch_size] = len(frames) / (time.time() - start_time)
+        print('batch_size {} : {:.1f} frames/sec'.format(batch_size, result[batch_size]), flush=True)
+
+    return result
+
+
+def offset_cos_sim(features, offset):
+    """Cosine distance between features[i] and features[i + offset] for all i at once.
+    Same value as scipy.spatial.distance.cosine, computed with a row-wise dot product
+    of the features.
+    Returns array [num_frame - 1], entries without a pair (i + offset >= num_frame) are 0
+    """
+    num_frame = features.shape[0]
+    cos_sim = np.zeros((max(num_frame - 1, 0)))
+    if num_frame <= offset:
+        return cos_sim
+
+    squared_norm = np.einsum('ij,ij->i', features, features)
+    dot = np.einsum('ij,ij->i', features[offset:], features[:-offset])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dist = 1.0 - dot / np.sqrt(squared_norm[offset:] * squared_norm[:-offset])
+    cos_sim[:num_frame - offset] = np.clip(dist, 0.0, 2.0)
+    return cos_sim
+
+
+def stream_frame_features(frames, model, block_size, batch_size=32):
+    """Yield flattened float64 features [block, 512*7*7] of consecutive frame blocks"""
+    for block in frame_blocks(frames, block_size):
+        block_features = extract_frame_features(model, block, batch_size=batch_size).reshape((len(block), -1))
+        yield block_features.astype(np.float64)
+
+
+def fit_incremental_pca(feature_blocks, n_components=100, pca=None):
+    """partial_fit an IncrementalPCA over feature blocks.
+    IncrementalPCA needs at least n_components samples per partial_fit, so small blocks are
+    gathered and the last remainder is fitted together with the previous batch.
+    If pca is given, the fit continues from it (used to fit one basis over several videos).
+    """
+    if pca is None:
+        pca = IncrementalPCA(n_components=n_components)
+
+    held = None
+    pending = None
+    for block_features in feature_blocks:
+        pending = block_features if pending is None else np.concatenate((pending, block_features), 0)
+        if pending.shape[0] >= pca.n_components:
+            if held is not None:
+                pca.partial_fit(held)
+            held, pending = pending, None
+    if pending is not None:
+        held = pending if held is None else np.concatenate((held, pending), 0)
+    if held is not None:
+        pca.partial_fit(held)
+
+    return pca
+
+
+def fit_reference_pca(video_list, model, pca_path, n_components=100, block_size=256, batch_size=32):
+    """Fit one PCA basis on a reference corpus and save it to pca_path.
+    video_list : list of (video_dir, total_frame)
+    The saved basis is used by candidate_extraction(pca_mode='reference').
+    """
+    pca = IncrementalPCA(n_components=n_components)
+    for idx, (video_dir, total_frame) in enumerate(video_list):
+        print('[INFO] fitting reference PCA {}/{} : {}'.format(idx + 1, len(video_list), video_dir), flush=True)
+        feature_blocks = stream_frame_features(read_video_frames(video_dir, total_frame), model, block_size,
+                                               batch_size=batch_size)
+        pca = fit_incremental_pca(feature_blocks, pca=pca)
+
+    with open(pca_path, 'wb') as f:
+        pickle.dump(pca, f)
+    return pca
+
+
+def load_pca(pca_path):
+    with open(pca_path, 'rb') as f:
+        return pickle.load(f)
+
+
+def streaming_cos_sim(frames, model, offset, block_size, batch_size=32, pca=None):
+    """Cosine distance between frame i and frame i + offset from a frame stream.
+    Features are projected with a fitted pca if given, else they are compared without PCA.
+    Only the last `offset` frame features are kept between blocks, so memory is bounded by
+    block_size + offset frames whatever the length of the video.
+    Returns (cos_sim, num_frame), cos_sim has the same layout as the non-streaming path.
+    """
+    tail = None
+    cos_sim = list()
+    num_frame = 0
+    for block_features in stream_frame_features(frames, model, block_size, batch_size=batch_size):
+        num_frame += block_features.shape[0]
+        if pca is not None:
+            block_features = pca.transform(block_features)
+        if tail is not None:
+            block_features = np.concatenate((tail, block_features), 0)
+        cos_sim.append(offset_cos_sim(block_features, offset)[:max(block_features.shape[0] - offset, 0)])
+        tail = block_features[-offset:]
+
+    cos_sim_arr = np.zeros((max(num_frame - 1, 0)))
+    if len(cos_sim) != 0:
+        cos_sim = np.concatenate(cos_sim)
+        cos_sim_arr[:cos_sim.shape[0]] = cos_sim
+    return cos_sim_arr, num_frame
+
+
+def candidate_extraction(root_dir, video_file, total_frame, model, adjacent=True, streaming=False, block_size=256,
+                         batch_size=32, pca_mode='full', pca_path=None, cache_dir=None, frame_store=None,
+                         distance_threshold=0.2, return_distances=False, decode_size=None):
+    """Extract candidate boundary frames of a video : frames whose cosine distance to the next frame
+    (or to the frame 32 frames later, adjacent=False) is above distance_threshold.
+    pca_mode
+        full        : fit PCA on all frame features of the video (needs the whole video in memory)
+        incremental : partial_fit IncrementalPCA over frame blocks, then transform in a second pass
+        reference   : transform with a basis fitted once by fit_reference_pca (loaded from pca_path)
+        none        : compare SqueezeNet features without PCA
+    'incremental' and 'reference' always decode the video as a stream. With streaming=True,
+    'full' is not possible and behaves as 'none'.
+    cos_sim is cached in a FeatureCache (default : root_dir/feature_cache) keyed by the video content,
+    the backbone and the parameters above.
+    If frame_store (lib.frame_store.FrameStore) is given, frames are read from it instead of decoding the video,
+    so the same decoded frames can be reused for clip classification.
+    With return_distances=True, (boundary_index, cos_sim) is returned, e.g. to calibrate distance_threshold.
+    With decode_size, decoded frames are resized to decode_size x decode_size at once instead of being kept
+    at full resolution until the 128 x 128 resize of the feature extraction (cv2 INTER_AREA instead of PIL resize).
+    """
+    assert pca_mode in ['full', 'incremental', 'reference', 'none']
+    assert pca_mode != 'reference' or (pca_path and os.path.isfile(pca_path)), \
+        'pca_mode reference needs the basis file of fit_reference_pca (--candidate_pca_path), got {!r}'.format(pca_path)
+    if pca_mode in ['incremental', 'reference']:
+        streaming = True
     video_name = str(os.path.splitext(video_file)[0])
     video_full_name = os.path.join(root_dir, video_name)
     video_dir = os.path.join(root_dir, video_file)
 
     # print('[INFO] loading video...', flush=True)
     # input video (cv2)
-    cap = cv2.VideoCapture(video_dir)
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
-
-    video = list()
-    while (cap.isOpened()):
-        _, frame_image = cap.read()
-        frame_num = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
-        video.append(frame_image)
-        if frame_num == total_frame:
-            break
-
-    num_frame = 0
-    for i, im in enumerate(video):
-        num_frame += 1
+    fps = int(VideoReader(video_dir).fps)
 
     # 19.4.9. add
     # model = SqueezeNetFeature().cuda(device)
@@ -43,26 +225,54 @@ def candidate_extraction(root_dir, video_file, total_frame, model, adjacent=True
     else:
         feature_path = video_full_name + '.no_adjacent.features'
 
+    # frames of frame_store are already decoded
+    decode_size_wh = (decode_size, decode_size) if decode_size and frame_store is None else None
+
+    def video_frames():
+        if frame_store is not None:
+            return frame_store.frames()
+        return read_video_frames(video_dir, total_frame, size=decode_size_wh)
+
     threshold = 32
-    if os.path.isfile(feature_path):
+    if streaming and pca_mode == 'full':
+        pca_mode = 'none'
+    cache_params = {
+        'backbone': type(model).__name__,
+        'input_size': 128,
+        'offset': 1 if adjacent else threshold,
+        'total_frame': total_frame,
+        'pca_mode': pca_mode,
+        'n_components': 100 if pca_mode != 'none' else None,
+        'pca_basis': file_hash(pca_path) if pca_mode == 'reference' else None
+    }
+    if decode_size_wh is not None:
+        cache_params['decode_size'] = decode_size
+    feature_cache = FeatureCache(cache_dir if cache_dir is not None else os.path.join(root_dir, 'feature_cache'))
+    cached = feature_cache.load(video_dir, cache_params)
+    if cached is not None:
         # print('[INFO] loading video feature ...', flush=True)
-        with open(feature_path, 'rb') as f:
-            cos_sim = pickle.load(f)
+        cos_sim = cached['cos_sim']
+        num_frame = cos_sim.shape[0] + 1
+    elif streaming:
+        print('[INFO] calculate cos similarity from frame stream...', flush=True)
+        offset = 1 if adjacent else threshold
+        pca = None
+        if pca_mode == 'incremental':
+            print('[INFO] fitting incremental PCA...', flush=True)
+            feature_blocks = stream_frame_features(video_frames(), model, block_size, batch_size=batch_size)
+            pca = fit_incremental_pca(feature_blocks)
+        elif pca_mode == 'reference':
+            pca = load_pca(pca_path)
+        cos_sim, num_frame = streaming_cos_sim(video_frames(), model, offset, block_size,
+                                               batch_size=batch_size, pca=pca)
+
+        print('[INFO] saving video feature cache...', flush=True)
+        feature_cache.save(video_dir, cache_params, {'cos_sim': cos_sim})
     else:
-        frame_feature_arr = np.zeros((num_frame, 512, 7, 7))
-        for i, im in enumerate(video):
-            # if i % 500 == 0:
-            #     print(str(i) + '/' + str(len(video)), flush=True)
-
-            # im_np = np.array(im) # cv2 always return numpy array
-            im = Image.fromarray(im).resize((128, 128))
-            frame = np.array(im)
+        video = frame_store if frame_store is not None else list(video_frames())
+        num_frame = len(video)
 
-            frame_tensor = torch.from_numpy(frame).transpose(0, 1).transpose(0, 2).unsqueeze(0).float()
-            frame_tensor = frame_tensor.cuda(device, non_blocking=True)
-            frame_feature_tensor = model(frame_tensor).cpu()
-            frame_feature_np = frame_feature_tensor.squeeze(0).data.numpy()
-            frame_feature_arr[i] = frame_feature_np
+        frame_feature_arr = extract_frame_features(model, video, batch_size=batch_size).astype(np.float64)
 
         # compare cosine similarity between all consecutive frames
         frame_feature_arr = frame_feature_arr.reshape((frame_feature_arr.shape[0], -1))
@@ -75,7 +285,7 @@ def candidate_extraction(root_dir, video_file, total_frame, model, adjacent=True
             denom[denom == 0] = 1
             return x_min + nom / denom
 
-        do_PCA = True
+        do_PCA = pca_mode == 'full'
         if do_PCA:
             pca = PCA(n_components=100)
             frame_feature_arr_new = pca.fit(frame_feature_arr).transform(frame_feature_arr)
@@ -83,7 +293,6 @@ def candidate_extraction(root_dir, video_file, total_frame, model, adjacent=True
             frame_feature_arr_new = frame_feature_arr
 
         visualize_features = False
-        cos_sim = np.zeros((frame_feature_arr.shape[0] - 1))
         if visualize_features:
             ''' with PCA '''
             features_normalized_matrix = scale(frame_feature_arr_new.transpose(), 0, 1)
@@ -96,22 +305,14 @@ def candidate_extraction(root_dir, video_file, total_frame, model, adjacent=True
             print('exit program because you select feature visualization', flush=True)
             sys.exit(1)
         else:
-            if adjacent:
-                for i in range(frame_feature_arr_new.shape[0] - 1):
-                    cos_sim[i] = cosine(frame_feature_arr_new[i + 1], frame_feature_arr_new[i])
-            else:
-                i = 0
-                while i+threshold < frame_feature_arr_new.shape[0]:
-                    cos_sim[i] = cosine(frame_feature_arr_new[i + threshold], frame_feature_arr_new[i])
-                    i += 1
+            cos_sim = offset_cos_sim(frame_feature_arr_new, 1 if adjacent else threshold)
 
-        with open(feature_path, 'wb') as f:
-            print('[INFO] saving video feature pickle...', flush=True)
-            pickle.dump(cos_sim, f)
+        print('[INFO] saving video feature cache...', flush=True)
+        feature_cache.save(video_dir, cache_params, {'cos_sim': cos_sim})
 
     do_figure = False
     if do_figure:
-        x_index = np.arange(1, frame_feature_arr.shape[0], 1)
+        x_index = np.arange(1, num_frame, 1)
         plt.figure()
         plt.title(video_name)
         plt.plot(x_index, cos_sim, 'b*')
@@ -120,22 +321,17 @@ def candidate_extraction(root_dir, video_file, total_frame, model, adjacent=True
         plt.title('cosine similarity')
         plt.show()
 
-    boundary_index = np.array(list())
     new_arr = list()
     new_boundary_index = list()
     if adjacent:
-        for i in range(cos_sim.shape[0]):
-            if cos_sim[i] > 0.2:
-                boundary_index = np.append(boundary_index, i)
+        boundary_index = np.flatnonzero(cos_sim > distance_threshold).astype(np.float64)
         # new_arr.append(list(cos_sim))
         # new_arr.append(list(boundary_index))
         # json.dump(new_arr, open(os.path.join(root_dir, video_name + '.adjacent.json'), 'w'), indent=1)
         # scipy.misc.imsave(feature_path + '.adjacent.feature.png', torch.Tensor(cos_sim).unsqueeze(0))
 
     else:
-        for i in range(cos_sim.shape[0]):
-            if cos_sim[i] > 0.2:
-                boundary_index = np.append(boundary_index, i + threshold/2 - 1)
+        boundary_index = np.flatnonzero(cos_sim > distance_threshold) + threshold/2 - 1
         last = -1
         for boundary in boundary_index:
             if boundary - last == 1:
@@ -180,6 +376,8 @@ def candidate_extraction(root_dir, video_file, total_frame, model, adjacent=True
                     f.write('transitive# ' + str(bound_1) + ' ~ ' + str(bound_2) + '\n')
                     f.write('\n')
 
+    if return_distances:
+        return boundary_index, cos_sim
     return boundary_index
 
 
@@ -196,6 +394,20 @@ if __name__ == '__main__':
 
     print('[INFO] extracting candidate')
     model = SqueezeNetFeature()
+
+    do_benchmark = False
+    if do_benchmark:
+        frames = list(read_video_frames(os.path.join(root_dir, video_file), 1000))
+        benchmark_feature_extraction(model, frames)
+
+    # reference PCA basis of --candidate_pca reference (--candidate_pca_path), fitted on every video of root_dir
+    do_fit_pca = False
+    if do_fit_pca:
+        pca_path = os.path.join(root_dir, 'reference.pca')
+        video_list = [(os.path.join(root_dir, name), VideoReader(os.path.join(root_dir, name)).frame_count)
+                      for name in sorted(os.listdir(root_dir))
+                      if os.path.splitext(name)[1].lower() in ['.mp4', '.avi', '.mkv', '.mov']]
+        fit_reference_pca(video_list, model, pca_path)
     boundary_index_adj, total_length, fps = candidate_extraction(root_dir, video_file, model, adjacent=True)
     boundary_index_no_adj, total_length, fps = candidate_extraction(root_dir, video_file, model, adjacent=False)
     print(boundary_index_adj)
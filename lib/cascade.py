@@ -0,0 +1,134 @@
+import numpy as np
+import torch
+
+# two stage test : cheap per-frame candidate boundaries first, then the 3D detector
+# only on the test windows around them (window i : frames [i * sample_duration / 2, + sample_duration))
+
+
+def candidate_windows(boundary_index, num_windows, sample_duration, margin=0):
+    """indices of the test windows which contain a candidate boundary frame, +- margin frames"""
+    stride = sample_duration // 2
+    boundary_index = np.asarray(boundary_index).astype(np.int64).reshape(-1)
+    if boundary_index.shape[0] == 0 or num_windows == 0:
+        return np.zeros(0, dtype=np.int64)
+    # window i intersects [b - margin, b + margin] : b - margin - sample_duration < i * stride <= b + margin
+    first = np.maximum(-((sample_duration - 1 + margin - boundary_index) // stride), 0)
+    last = np.minimum((boundary_index + margin) // stride, num_windows - 1)
+    valid = first <= last
+    coverage = np.zeros(num_windows + 1, dtype=np.int64)
+    np.add.at(coverage, first[valid], 1)
+    np.add.at(coverage, last[valid] + 1, -1)
+    return np.flatnonzero(np.cumsum(coverage[:-1]) > 0)
+
+
+def fill_background(prediction, window_index, num_windows, sample_duration):
+    """predictions (start frame, label) of the classified windows > predictions of every window,
+    windows which were not classified are background. same layout as a test of every window
+    """
+    full = torch.zeros(num_windows, 2, dtype=prediction.dtype if prediction.numel() != 0 else torch.long)
+    full[:, 0] = torch.arange(num_windows) * (sample_duration // 2)
+    if prediction.numel() != 0:
+        full[torch.from_numpy(np.asarray(window_index, dtype=np.int64))] = prediction.cpu().view(-1, 2)
+    return full
+
+
+def transition_scores(distances, transitions, margin=0):
+    """highest frame distance within +- margin frames of each transition [start, end], -inf if there is none"""
+    distances = np.asarray(distances, dtype=np.float64)
+    scores = np.full(len(transitions), -np.inf)
+    for i, (start, end) in enumerate(transitions):
+        window = distances[max(int(start) - margin, 0):int(end) + margin + 1]
+        if window.shape[0] != 0:
+            scores[i] = window.max()
+    return scores
+
+
+def calibrate_threshold(scores, recall_target):
+    """highest distance threshold (candidate : distance > threshold) which keeps recall_target of the transitions,
+    scores : transition_scores of every transition of the calibration videos
+    """
+    scores = np.sort(np.asarray(scores, dtype=np.float64))[::-1]
+    if scores.shape[0] == 0:
+        return None
+    need = int(np.ceil(recall_target * scores.shape[0]))
+    if need == 0:
+        return float(scores[0])
+    return float(np.nextafter(scores[need - 1], -np.inf))
+
+
+def boundary_recall(boundary_index, transitions, margin=0):
+    """ratio of transitions [start, end] with a candidate boundary within +- margin frames"""
+    if len(transitions) == 0:
+        return 1.0
+    boundary_index = np.sort(np.asarray(boundary_index, dtype=np.float64).reshape(-1))
+    transitions = np.asarray(transitions, dtype=np.float64).reshape(-1, 2)
+    first = np.searchsorted(boundary_index, transitions[:, 0] - margin, side='left')
+    last = np.searchsorted(boundary_index, transitions[:, 1] + margin, side='right')
+    return float((last > first).mean())
+
+
+class CandidateStage:
+    """First stage of the cascade : candidate boundary frames of a video,
+    frames whose distance to the next frame is above opt.cascade_threshold.
+    opt.candidate_method
+        squeezenet : cosine distance of SqueezeNet features (lib.candidate_extracting)
+        histogram  : HSV histogram / pixel distance of small frames, no CNN (lib.histogram_candidate)
+    """
+    def __init__(self, opt):
+        assert opt.candidate_method in ['squeezenet', 'histogram']
+        self.opt = opt
+        self.model = None
+        if opt.candidate_method == 'squeezenet':
+            from models.squeezenet import SqueezeNetFeature
+            self.model = SqueezeNetFeature().to(opt.device)
+
+    def boundaries(self, root_dir, video_name, total_frame, return_distances=False, frame_store=None):
+        """frame_store : lib.frame_store.FrameStore of the video, read instead of decoding the video again"""
+        opt = self.opt
+        cache_dir = opt.feature_cache_dir if opt.feature_cache_dir else None
+        if opt.candidate_method == 'histogram':
+            from lib.histogram_candidate import histogram_candidate_extraction
+            out = histogram_candidate_extraction(root_dir, video_name, total_frame,
+                                                 distance_threshold=opt.cascade_threshold,
+                                                 block_size=opt.candidate_block_size, cache_dir=cache_dir,
+                                                 return_distances=return_distances, frame_step=opt.candidate_step,
+                                                 frame_store=frame_store)
+        else:
+            from lib.candidate_extracting import candidate_extraction
+            out = candidate_extraction(root_dir, video_name, total_frame, self.model, adjacent=True,
+                                       streaming=opt.candidate_streaming, block_size=opt.candidate_block_size,
+                                       batch_size=opt.candidate_batch_size, pca_mode=opt.candidate_pca,
+                                       pca_path=opt.candidate_pca_path, cache_dir=cache_dir,
+                                       distance_threshold=opt.cascade_threshold, return_distances=return_distances,
+                                       decode_size=opt.decode_size, frame_store=frame_store)
+        # without the first and the last frame added for the shot list
+        if return_distances:
+            return out[0][1:-1], out[1]
+        return out[1:-1]
+
+    def windows(self, root_dir, video_name, total_frame, num_windows, frame_store=None):
+        boundary_index = self.boundaries(root_dir, video_name, total_frame, frame_store=frame_store)
+        return candidate_windows(boundary_index, num_windows, self.opt.sample_duration, self.opt.cascade_margin)
+
+
+def check_candidate_windows(trial=1000, seed=0):
+    """candidate_windows against a window by window loop"""
+    rng = np.random.RandomState(seed)
+    for _ in range(trial):
+        sample_duration = int(rng.choice([8, 16, 32]))
+        num_windows = rng.randint(0, 50)
+        margin = rng.randint(0, 20)
+        boundary_index = np.sort(rng.randint(0, num_windows * sample_duration // 2 + sample_duration + 1,
+                                             rng.randint(0, 10)))
+        expected = [i for i in range(num_windows)
+                    if any(i * (sample_duration // 2) <= b + margin and
+                           b - margin < i * (sample_duration // 2) + sample_duration for b in boundary_index)]
+        res = candidate_windows(boundary_index, num_windows, sample_duration, margin).tolist()
+        assert res == expected, (boundary_index, num_windows, sample_duration, margin, res, expected)
+    print('[INFO] candidate_windows : same as reference', flush=True)
+
+
+if __name__ == '__main__':
+    do_check = True
+    if do_check:
+        check_candidate_windows()
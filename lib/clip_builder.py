@@ -0,0 +1,57 @@
+import numpy as np
+import torch
+
+
+class ClipBuilder:
+    """Gather clips from one contiguous video tensor [num_frame, C, H, W] by frame index.
+    A batch of clips is written with a single index_select into a preallocated buffer
+    (pinned when the target device is cuda) and returned as [B, C, T, H, W] on the device.
+    Two buffers are used in turn, so the host can fill the next batch while the previous copy
+    to the device is still running. A returned batch stays valid until build() is called twice more.
+    """
+    def __init__(self, video_tensor, temporal_length, batch_size, device, frame_index=None):
+        self.video = video_tensor.contiguous()
+        self.temporal_length = temporal_length
+        self.batch_size = batch_size
+        self.device = torch.device(device)
+        # frame_index : sorted frame numbers of the rows of video_tensor, if it holds only part of the video
+        self.frame_index = frame_index
+
+        pin_memory = self.device.type == 'cuda'
+        buffer_shape = (batch_size * temporal_length,) + tuple(self.video.shape[1:])
+        self.buffers = [torch.empty(buffer_shape, dtype=self.video.dtype, pin_memory=pin_memory) for _ in range(2)]
+        self.events = [None, None]
+        self.turn = 0
+
+    def clip_index(self, start_frames, end_frames):
+        """[B, T] frame indices of clips start_frames[i] .. end_frames[i] - 1,
+        cut to T frames and padded by repeating the last frame
+        """
+        start_frames = torch.as_tensor(np.asarray(start_frames), dtype=torch.long).view(-1, 1)
+        end_frames = torch.as_tensor(np.asarray(end_frames), dtype=torch.long).view(-1, 1)
+        index = start_frames + torch.arange(self.temporal_length, dtype=torch.long).view(1, -1)
+        return torch.min(index, end_frames - 1)
+
+    def build(self, start_frames, end_frames):
+        index = self.clip_index(start_frames, end_frames)
+        num_clips = index.size(0)
+        assert num_clips <= self.batch_size
+        index = index.view(-1)
+        if self.frame_index is not None:
+            index = torch.from_numpy(np.searchsorted(self.frame_index, index.numpy())).to(torch.long)
+
+        buffer = self.buffers[self.turn]
+        if self.events[self.turn] is not None:
+            self.events[self.turn].synchronize()
+        out = buffer[:index.numel()]
+        torch.index_select(self.video, 0, index, out=out)
+
+        clips = out.view((num_clips, self.temporal_length) + tuple(self.video.shape[1:]))
+        clips = clips.to(self.device, non_blocking=True)
+        if self.device.type == 'cuda':
+            self.events[self.turn] = torch.cuda.Event()
+            self.events[self.turn].record()
+        self.turn = 1 - self.turn
+
+        # [B, T, C, H, W] > [B, C, T, H, W]
+        return clips.permute(0, 2, 1, 3, 4)
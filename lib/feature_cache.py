@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+CACHE_VERSION = 1
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Content hash of a file.
+    Video files are large, so only the size and the first, middle and last chunk are hashed.
+    """
+    size = os.path.getsize(path)
+    sha = hashlib.sha1(str(size).encode('utf-8'))
+    with open(path, 'rb') as f:
+        for offset in sorted({0, max(size // 2 - chunk_size // 2, 0), max(size - chunk_size, 0)}):
+            f.seek(offset)
+            sha.update(f.read(chunk_size))
+    return sha.hexdigest()
+
+
+class FeatureCache:
+    """Content-addressed cache of per-video arrays.
+    Each entry is a directory named by hash(video content, params) holding one .npy file per array
+    and a manifest.json with the cache version, the video hash and the params.
+    Arrays are opened memory-mapped and read-only, so several processes can share an entry.
+    """
+    def __init__(self, cache_dir, version=CACHE_VERSION):
+        self.cache_dir = cache_dir
+        self.version = version
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _params_str(params):
+        return json.dumps(params, sort_keys=True)
+
+    def key(self, video_hash, params):
+        return hashlib.sha1((video_hash + self._params_str(params)).encode('utf-8')).hexdigest()
+
+    def entry_dir(self, video_path, params):
+        video_hash = file_hash(video_path)
+        return os.path.join(self.cache_dir, self.key(video_hash, params)), video_hash
+
+    def _read_manifest(self, entry_dir):
+        manifest_path = os.path.join(entry_dir, 'manifest.json')
+        if not os.path.isfile(manifest_path):
+            return None
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+
+    def _is_valid(self, manifest, video_hash, params):
+        return manifest is not None \
+            and manifest['version'] == self.version \
+            and manifest['video_hash'] == video_hash \
+            and manifest['params'] == json.loads(self._params_str(params))
+
+    def load(self, video_path, params, mmap_mode='r'):
+        """Return dict of arrays, or None if there is no entry or the entry is stale"""
+        entry_dir, video_hash = self.entry_dir(video_path, params)
+        manifest = self._read_manifest(entry_dir)
+        if not self._is_valid(manifest, video_hash, params):
+            if manifest is not None:
+                print('[INFO] stale feature cache : {}'.format(entry_dir), flush=True)
+            return None
+
+        arrays = dict()
+        for name in manifest['arrays']:
+            arrays[name] = np.load(os.path.join(entry_dir, name + '.npy'), mmap_mode=mmap_mode)
+        return arrays
+
+    def save(self, video_path, params, arrays):
+        """Write arrays to a temporary directory and move it into place,
+        so readers never see a partially written entry.
+        """
+        entry_dir, video_hash = self.entry_dir(video_path, params)
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp_')
+        manifest = {
+            'version': self.version,
+            'video': os.path.basename(video_path),
+            'video_hash': video_hash,
+            'params': params,
+            'arrays': dict()
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, name + '.npy'), array)
+            manifest['arrays'][name] = {'shape': list(array.shape), 'dtype': str(array.dtype)}
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        if os.path.exists(entry_dir) and not self._is_valid(self._read_manifest(entry_dir), video_hash, params):
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # another process saved the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        return entry_dir
+
+    def prune(self, tmp_age=24 * 3600):
+        """Remove entries written by another cache version,
+        and temporary directories older than tmp_age seconds (left by interrupted writes)
+        """
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(path):
+                continue
+            if name.startswith('.tmp_'):
+                if time.time() - os.path.getmtime(path) > tmp_age:
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+                continue
+            manifest = self._read_manifest(path)
+            if manifest is None or manifest['version'] != self.version:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
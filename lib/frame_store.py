@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import collections
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from lib.video_reader import VideoReader
+
+
+class FrameStore:
+    """Decoded frames of one video, shared by candidate extraction and clip classification.
+    Frames are decoded once into a uint8 memory-mapped array [num_frame, H, W, 3] (BGR, as cv2 decodes them)
+    and are read by frame index.
+    Preprocessing is lazy : get(idx, transform) transforms a frame on first access and keeps the result
+    in a bounded LRU cache, so frames shared by overlapping clips are transformed once.
+    The cache is keyed by the transform object (or an explicit key), which stays referenced while cached.
+    """
+    def __init__(self, video_path=None, total_frame=None, store_dir=None, size=None, cache_size=256):
+        self.video_path = video_path
+        self.size = size
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._tmp_dir = None
+        self.frames_arr = None
+        self.num_frame = 0
+
+        if video_path is not None:
+            if store_dir is None:
+                self._tmp_dir = tempfile.mkdtemp(prefix='frame_store_')
+                store_dir = self._tmp_dir
+            self._decode(video_path, total_frame, os.path.join(store_dir, 'frames.uint8'))
+
+    @classmethod
+    def from_frames(cls, frames, cache_size=256):
+        """Wrap frames which are already decoded (list of frames or array [num_frame, H, W, 3]) without copy"""
+        store = cls(cache_size=cache_size)
+        store.frames_arr = frames
+        store.num_frame = len(frames)
+        return store
+
+    def _decode(self, video_path, total_frame, store_path):
+        # frames are resized by the reader right after decoding
+        reader = VideoReader(video_path, size=self.size)
+        if total_frame is None:
+            total_frame = reader.frame_count
+        reader.end = total_frame
+
+        num_frame = 0
+        for frame_image in reader:
+            if self.frames_arr is None:
+                self.frames_arr = np.memmap(store_path, dtype=np.uint8, mode='w+',
+                                            shape=(total_frame,) + frame_image.shape)
+            self.frames_arr[num_frame] = frame_image
+            num_frame += 1
+
+        if self.frames_arr is None:
+            self.frames_arr = np.zeros((0, 0, 0, 3), dtype=np.uint8)
+        else:
+            self.frames_arr.flush()
+        self.num_frame = num_frame
+
+    def __len__(self):
+        return self.num_frame
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self.frames_arr[:self.num_frame][idx]
+        if idx < 0:
+            idx += self.num_frame
+        if not 0 <= idx < self.num_frame:
+            raise IndexError('frame index {} out of range ({} frames)'.format(idx, self.num_frame))
+        return self.frames_arr[idx]
+
+    def __iter__(self):
+        return self.frames()
+
+    def frames(self, start=0, end=None):
+        end = self.num_frame if end is None else min(end, self.num_frame)
+        for idx in range(start, end):
+            yield self.frames_arr[idx]
+
+    def get(self, idx, transform, key=None):
+        """Frame idx after transform, transformed at most once while it stays in the LRU cache.
+        key : cache key of the transform (default : the transform itself), e.g. the spatial transform
+              wrapped by a closure which is created again for every call
+        """
+        key = (transform if key is None else key, idx)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        value = transform(self[idx])
+        self._cache[key] = value
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return value
+
+    def close(self):
+        self._cache.clear()
+        self.frames_arr = None
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def to_pil_rgb(frame):
+    """BGR frame of cv2 > RGB PIL image, the input of spatial_transform"""
+    return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)).convert('RGB')
+
+
+class FrameStoreWindows(torch.utils.data.Dataset):
+    """Test windows read from a FrameStore, same items as the test dataset : (clip [C, T, H, W], start frame).
+    Window i covers frames [start_frames[i], start_frames[i] + sample_duration),
+    padded at the end of the video by repeating the last frame.
+    Frames go through to_pil_rgb and spatial_transform by the LRU cache of the store,
+    so the half shared by overlapping windows is transformed once.
+    """
+    def __init__(self, store, start_frames, sample_duration, spatial_transform):
+        self.store = store
+        self.start_frames = np.asarray(start_frames, dtype=np.int64).reshape(-1)
+        self.sample_duration = sample_duration
+        self.spatial_transform = spatial_transform
+
+    def transform(self, frame):
+        return self.spatial_transform(to_pil_rgb(frame))
+
+    def __len__(self):
+        return self.start_frames.shape[0]
+
+    def __getitem__(self, idx):
+        start = int(self.start_frames[idx])
+        index = np.minimum(np.arange(start, start + self.sample_duration), len(self.store) - 1)
+        clip = torch.stack([self.store.get(int(j), self.transform, key=self.spatial_transform) for j in index], 1)
+        return clip, start
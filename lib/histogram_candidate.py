@@ -0,0 +1,146 @@
+import os
+import time
+import cv2
+import numpy as np
+
+from lib.feature_cache import FeatureCache
+from lib.video_reader import VideoReader
+
+# candidate boundary frames without CNN : HSV colour histogram and pixel difference of small frames
+HIST_BINS = (8, 4, 4)
+
+
+def read_small_frames(video_dir, total_frame, size=64, step=1):
+    """Decode a video frame by frame, each frame resized to size x size right after decoding.
+    with step > 1, only every step-th frame is retrieved
+    """
+    return VideoReader(video_dir, size=(size, size), step=step, end=total_frame)
+
+
+def frame_signatures(frames, bins=HIST_BINS):
+    """small BGR frames [n, h, w, 3] uint8 > normalized HSV histograms [n, prod(bins)], grey frames [n, h * w] float32
+    all frames of the block are converted as one image
+    """
+    n, h, w = frames.shape[:3]
+    image = np.ascontiguousarray(frames).reshape(n * h, w, 3)
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV).reshape(n, h * w, 3).astype(np.int64)
+    # opencv 8 bit hue : 0 ~ 179
+    bin_index = (hsv[..., 0] * bins[0] // 180) * (bins[1] * bins[2]) \
+        + (hsv[..., 1] * bins[1] // 256) * bins[2] + hsv[..., 2] * bins[2] // 256
+    num_bins = bins[0] * bins[1] * bins[2]
+    bin_index += np.arange(n).reshape(-1, 1) * num_bins
+    hist = np.bincount(bin_index.reshape(-1), minlength=n * num_bins).reshape(n, num_bins).astype(np.float32)
+    hist /= h * w
+    grey = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY).reshape(n, h * w).astype(np.float32) / 255.
+    return hist, grey
+
+
+def histogram_distances(frames, pixel_weight=0.5, block_size=256, bins=HIST_BINS):
+    """distance of each frame to the next one, in [0, 1] :
+    (1 - pixel_weight) * half L1 distance of HSV histograms + pixel_weight * mean absolute grey difference
+    frames : iterable of small BGR frames, read block by block
+    """
+    distances = list()
+    last_hist, last_grey = None, None
+    num_frame = 0
+    block = list()
+
+    def flush(block, last_hist, last_grey):
+        hist, grey = frame_signatures(np.stack(block, 0), bins)
+        # the last frame of the previous block is compared with the first one of this block
+        if last_hist is not None:
+            hist = np.concatenate((last_hist[None], hist), 0)
+            grey = np.concatenate((last_grey[None], grey), 0)
+        hist_dist = 0.5 * np.abs(hist[1:] - hist[:-1]).sum(1)
+        pixel_dist = np.abs(grey[1:] - grey[:-1]).mean(1)
+        distances.append((1 - pixel_weight) * hist_dist + pixel_weight * pixel_dist)
+        return hist[-1], grey[-1]
+
+    for frame in frames:
+        block.append(frame)
+        num_frame += 1
+        if len(block) == block_size:
+            last_hist, last_grey = flush(block, last_hist, last_grey)
+            block = list()
+    if len(block) != 0:
+        last_hist, last_grey = flush(block, last_hist, last_grey)
+
+    distances = np.concatenate(distances).astype(np.float64) if len(distances) != 0 else np.zeros(0)
+    return distances, num_frame
+
+
+def histogram_candidate_extraction(root_dir, video_file, total_frame, distance_threshold=0.2, size=64,
+                                   pixel_weight=0.5, block_size=256, cache_dir=None, frame_store=None,
+                                   return_distances=False, frame_step=1):
+    """Extract candidate boundary frames of a video without CNN : frames whose histogram / pixel distance
+    to the next frame is above distance_threshold.
+    Same contract as candidate_extracting.candidate_extraction(adjacent=True) :
+    boundary frame indices with 0 and the number of frames added at both ends.
+    Frames are decoded and resized to size x size at once (or read from frame_store), block_size frames at a time.
+    With frame_step > 1, only every frame_step-th frame is retrieved and compared, and the distance of
+    frames k * frame_step and (k + 1) * frame_step is given to every frame in between.
+    distances are cached in a FeatureCache (default : root_dir/feature_cache).
+    """
+    video_dir = os.path.join(root_dir, video_file)
+    cache_params = {
+        'backbone': 'histogram',
+        'input_size': size,
+        'offset': 1,
+        'total_frame': total_frame,
+        'bins': list(HIST_BINS),
+        'pixel_weight': pixel_weight,
+    }
+    if frame_step > 1:
+        cache_params['frame_step'] = frame_step
+    feature_cache = FeatureCache(cache_dir if cache_dir is not None else os.path.join(root_dir, 'feature_cache'))
+    cached = feature_cache.load(video_dir, cache_params)
+    if cached is not None:
+        distances = np.asarray(cached['cos_sim'])
+        num_frame = distances.shape[0] + 1
+    else:
+        if frame_store is not None:
+            frames = (cv2.resize(frame, (size, size), interpolation=cv2.INTER_AREA)
+                      for frame in frame_store[::frame_step])
+            distances, _ = histogram_distances(frames, pixel_weight, block_size)
+            num_frame = len(frame_store)
+        else:
+            reader = read_small_frames(video_dir, total_frame, size, frame_step)
+            distances, _ = histogram_distances(reader, pixel_weight, block_size)
+            num_frame = reader.num_frame
+        if frame_step > 1:
+            # distance of frame k to the next one : distance of the retrieved frames around it,
+            # 0 after the last retrieved frame
+            step_distances = np.repeat(distances, frame_step)[:max(num_frame - 1, 0)]
+            distances = np.zeros(max(num_frame - 1, 0))
+            distances[:step_distances.shape[0]] = step_distances
+        # same array name as the cosine distance of candidate_extraction
+        feature_cache.save(video_dir, cache_params, {'cos_sim': distances})
+
+    boundary_index = np.flatnonzero(distances > distance_threshold).astype(np.float64)
+    boundary_index = np.concatenate((np.array([0]), boundary_index, np.array([num_frame])))
+    if return_distances:
+        return boundary_index, distances
+    return boundary_index
+
+
+def benchmark_histogram(video_dir, total_frame=1000, size=64):
+    """frames/sec of decoding (+ resize) and of histogram_distances, on one core"""
+    cv2.setNumThreads(1)
+    start = time.time()
+    frames = list(read_small_frames(video_dir, total_frame, size))
+    decode_time = time.time() - start
+    start = time.time()
+    histogram_distances(frames)
+    distance_time = time.time() - start
+    print('[INFO] {} frames : decode {:.1f} frames/sec, distances {:.1f} frames/sec'.format(
+        len(frames), len(frames) / decode_time, len(frames) / max(distance_time, 1e-9)), flush=True)
+
+
+if __name__ == '__main__':
+    root_dir = '../misaeng_test'
+    video_file = '1001.0001.0001.0001.0008.mp4'
+
+    do_benchmark = False
+    if do_benchmark:
+        benchmark_histogram(os.path.join(root_dir, video_file))
+    print(histogram_candidate_extraction(root_dir, video_file, 10000))
@@ -0,0 +1,269 @@
+import time
+import contextlib
+import torch
+
+# torch.inference_mode (torch >= 1.9) also skips version counting of tensors, no_grad is the fallback
+inference_context = getattr(torch, 'inference_mode', torch.no_grad)
+
+
+def get_amp_dtype(device, amp):
+    """autocast dtype of device : bfloat16 on cpu, float16 on cuda. None if amp is off or not supported"""
+    if not amp:
+        return None
+    if not hasattr(torch, 'autocast'):
+        print('[INFO] torch.autocast is not supported by this torch version, amp is disabled', flush=True)
+        return None
+    return torch.float16 if torch.device(device).type == 'cuda' else torch.bfloat16
+
+
+def autocast(device, amp_dtype):
+    """autocast context of device, or a context which does nothing if amp_dtype is None"""
+    if amp_dtype is None:
+        return contextlib.suppress()
+    return torch.autocast(device_type=torch.device(device).type, dtype=amp_dtype)
+
+
+def get_grad_scaler(device, amp_dtype):
+    """GradScaler for float16 on cuda, None otherwise (bfloat16 has the range of float32 and needs no scaling)"""
+    if amp_dtype == torch.float16 and torch.device(device).type == 'cuda':
+        return torch.cuda.amp.GradScaler()
+    return None
+
+
+def get_stem_model(model):
+    """module of model with forward_stem / forward_head (inside DataParallel, student of TeacherStudentModule),
+    None if there is no such module
+    """
+    while not hasattr(model, 'forward_stem'):
+        if isinstance(model, torch.nn.DataParallel):
+            model = model.module
+        elif hasattr(model, 'student_model'):
+            model = model.student_model
+        else:
+            return None
+    return model
+
+
+def clips_to_chunk(clips, starts):
+    """clips [batch, c, t, h, w] starting every stride frames (stride < t) > [1, c, (batch - 1) * stride + t, h, w]
+    stride, or None if the clips are not evenly overlapping
+    """
+    if clips.size(0) < 2:
+        return None, None
+    steps = starts.view(-1)[1:] - starts.view(-1)[:-1]
+    stride = int(steps[0].item())
+    if not 0 < stride < clips.size(2) or not bool((steps == stride).all()):
+        return None, None
+    chunk = torch.cat((clips[:-1, :, :stride].transpose(0, 1).reshape(clips.size(1), -1, *clips.size()[3:]),
+                       clips[-1]), 1)
+    return chunk.unsqueeze(0), stride
+
+
+def shared_stem_forward(stem_model, clips, starts, num_stages, *args):
+    """forward of clips of a sliding window, where conv1 ~ layer[num_stages] runs once on the frames of the batch
+    and each window takes its part of the features, so the overlapping half is computed once.
+    This is a lossy approximation of the forward of each window : near the window edges the stages see the
+    neighbouring frames instead of zero padding, and the difference spreads inward by the temporal receptive radius
+    (7 frames after conv1 ~ layer1 of models.detector ResNeXt, so only 2 of 16 positions of a window are exact ;
+    recomputing the others would cost more than the whole window). Check a trained model with check_window_sharing.
+    Nothing is carried between batches : the first window of a batch recomputes the half it shares with the last
+    window of the previous batch.
+    Not used by test() : to be validated on a trained checkpoint first (check_window_sharing, benchmark_window_sharing).
+    None if the clips are not evenly overlapping or the stride is not a multiple of the temporal stride of the stem.
+    """
+    chunk, stride = clips_to_chunk(clips, starts)
+    if chunk is None:
+        return None
+    features = stem_model.forward_stem(chunk, num_stages)
+    if chunk.size(2) % features.size(2) != 0:
+        return None
+    scale = chunk.size(2) // features.size(2)
+    if stride % scale != 0 or clips.size(2) % scale != 0:
+        return None
+    # [1, c, t, h, w] > [batch, c, window, h, w]
+    features = features.unfold(2, clips.size(2) // scale, stride // scale)
+    features = features[0].permute(1, 0, 4, 2, 3).contiguous()
+    return stem_model.forward_head(features, *args, num_stages=num_stages)
+
+
+class InferenceEngine:
+    """Forward of a model at test time.
+    The forward runs in inference mode, and with amp=True under autocast :
+    bfloat16 on cpu, float16 on cuda (float outputs are cast back to float32 for post-processing).
+    With share_stages > 0 and the start frames of the clips given, evenly overlapping clips of a batch
+    run conv1 ~ layer[share_stages] once on their frames (see shared_stem_forward, outputs are approximate).
+    Clips and time are counted per video, start_video() / end_video() print clips/sec.
+    """
+    def __init__(self, model, device, amp=False, share_stages=0):
+        self.model = model
+        self.device = torch.device(device)
+        self.amp_dtype = get_amp_dtype(self.device, amp)
+        self.share_stages = share_stages
+        self.stem_model = get_stem_model(model) if share_stages > 0 else None
+        if share_stages > 0 and self.stem_model is None:
+            print('[INFO] model has no forward_stem, windows are not shared', flush=True)
+        elif share_stages > 0:
+            print('[INFO] windows share conv1 ~ layer{} : approximation, outputs differ from the forward '
+                  'of each window'.format(share_stages), flush=True)
+
+        self.clip_num = 0
+        self.video_time = 0
+
+    def autocast(self):
+        return autocast(self.device, self.amp_dtype)
+
+    @staticmethod
+    def _to_float(out):
+        if isinstance(out, (tuple, list)):
+            return type(out)(InferenceEngine._to_float(o) for o in out)
+        if torch.is_tensor(out) and out.is_floating_point():
+            return out.float()
+        return out
+
+    def __call__(self, clip, *args, starts=None):
+        with inference_context():
+            with self.autocast():
+                out = None
+                if self.stem_model is not None and starts is not None:
+                    out = shared_stem_forward(self.stem_model, clip, starts, self.share_stages, *args)
+                if out is None:
+                    out = self.model(clip, *args)
+        self.clip_num += clip.size(0)
+        return self._to_float(out)
+
+    def synchronize(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def start_video(self):
+        self.synchronize()
+        self.clip_num = 0
+        self.video_time = time.time()
+
+    def end_video(self, video_name=''):
+        self.synchronize()
+        elapsed = time.time() - self.video_time
+        clips_per_sec = self.clip_num / elapsed if elapsed > 0 else 0.
+        precision = 'fp32' if self.amp_dtype is None else str(self.amp_dtype).replace('torch.', '')
+        print('[INFO] {} : {} clips, {:.2f}s, {:.2f} clips/sec ({})'.format(
+            video_name, self.clip_num, elapsed, clips_per_sec, precision), flush=True)
+        return clips_per_sec
+
+
+def synthetic_video(num_frames, size, num_shots=4, seed=0):
+    """test video [3, num_frames, size, size] : still shots with noise, joined by cuts and 8 frame dissolves"""
+    generator = torch.Generator().manual_seed(seed)
+    shots = torch.rand(num_shots, 3, 1, size, size, generator=generator)
+    bounds = torch.linspace(0, num_frames, num_shots + 1)[1:-1].long().tolist()
+    weight = torch.zeros(num_shots, num_frames)
+    shot = 0
+    for t in range(num_frames):
+        while shot < len(bounds) and t >= bounds[shot]:
+            shot += 1
+        weight[shot, t] = 1
+        # odd shots begin with a dissolve from the previous one
+        if shot % 2 == 1 and t < bounds[shot - 1] + 8:
+            alpha = (t - bounds[shot - 1] + 1) / 9.
+            weight[shot, t], weight[shot - 1, t] = alpha, 1 - alpha
+    video = (shots * weight.view(num_shots, 1, num_frames, 1, 1)).sum(0)
+    return video + 0.02 * torch.randn(video.size(), generator=generator)
+
+
+def sliding_clips(video, sample_duration, num_clips):
+    """clips of video with stride sample_duration / 2 and their start frames"""
+    stride = sample_duration // 2
+    starts = torch.arange(num_clips) * stride
+    clips = torch.stack([video[:, s:s + sample_duration] for s in starts.tolist()], 0)
+    return clips, starts
+
+
+def read_video_tensor(video_path, num_frames, sample_size, norm_value=1):
+    """first num_frames frames of a video [3, num_frames, sample_size, sample_size],
+    scaled and normalized like the test spatial transform of cut models
+    """
+    from lib.video_reader import VideoReader
+    from lib.frame_store import to_pil_rgb
+    from lib.spatial_transforms import Compose, Scale, ToTensor, Normalize, get_mean
+    transform = Compose([Scale((sample_size, sample_size)), ToTensor(norm_value),
+                         Normalize(get_mean(norm_value), [1, 1, 1])])
+    frames = [transform(to_pil_rgb(frame)) for frame in VideoReader(video_path, end=num_frames)]
+    return torch.stack(frames, 1)
+
+
+def check_window_sharing(model, sample_duration=16, sample_size=64, num_clips=32, batch_size=8, seed=0, video=None,
+                         min_agreement=0.99, max_difference=1e-3):
+    """outputs and labels of shared_stem_forward against the forward of each window, for every number of stages.
+    video : [3, num_frames, h, w] frames (e.g. read_video_tensor of a test video), synthetic_video if None.
+    Fails (AssertionError) if the label agreement of a number of stages is below min_agreement,
+    or its max relative output difference is above max_difference (None : not checked). The default max_difference
+    only allows float rounding, so the lossy sharing fails it ; label agreement alone is only meaningful with
+    trained weights and real frames (an untrained net agrees with itself on almost any input).
+    return {num_stages : (max relative difference, label agreement)}
+    """
+    model.eval()
+    if video is None:
+        video = synthetic_video((num_clips + 1) * sample_duration // 2, sample_size, seed=seed)
+    num_clips = min(num_clips, (video.size(1) - sample_duration) // (sample_duration // 2) + 1)
+    clips, starts = sliding_clips(video, sample_duration, num_clips)
+    res = dict()
+    with inference_context():
+        reference = torch.cat([model(c) for c in clips.split(batch_size)], 0)
+        for num_stages in range(1, 5):
+            out = [shared_stem_forward(model, c, s, num_stages)
+                   for c, s in zip(clips.split(batch_size), starts.split(batch_size))]
+            if any(o is None for o in out):
+                print('[INFO] shared stages {} : temporal stride of the stem does not fit the window stride'.format(
+                    num_stages), flush=True)
+                continue
+            out = torch.cat(out, 0)
+            diff = (out - reference).abs().max().item() / reference.abs().max().item()
+            agreement = (out.argmax(1) == reference.argmax(1)).float().mean().item()
+            print('[INFO] shared stages {} : max relative difference {:.4f}, label agreement {:.3f} ({} clips)'.format(
+                num_stages, diff, agreement, num_clips), flush=True)
+            res[num_stages] = (diff, agreement)
+
+    failed = [n for n, (diff, agreement) in res.items()
+              if (min_agreement is not None and agreement < min_agreement)
+              or (max_difference is not None and diff > max_difference)]
+    assert len(failed) == 0, 'shared stages {} : outside the tolerance (label agreement >= {}, ' \
+                             'max relative difference <= {})'.format(failed, min_agreement, max_difference)
+    return res
+
+
+def benchmark_window_sharing(model, sample_duration=16, sample_size=64, num_clips=64, batch_size=16):
+    """clips/sec of the forward of each window and of shared_stem_forward"""
+    model.eval()
+    video = synthetic_video((num_clips + 1) * sample_duration // 2, sample_size)
+    clips, starts = sliding_clips(video, sample_duration, num_clips)
+    for num_stages in range(5):
+        with inference_context():
+            if num_stages > 0 and shared_stem_forward(model, clips[:2], starts[:2], num_stages) is None:
+                continue
+            start_time = time.time()
+            for c, s in zip(clips.split(batch_size), starts.split(batch_size)):
+                if num_stages == 0:
+                    model(c)
+                else:
+                    shared_stem_forward(model, c, s, num_stages)
+            elapsed = time.time() - start_time
+        print('[INFO] shared stages {} : {:.2f} clips/sec'.format(num_stages, num_clips / elapsed), flush=True)
+
+
+if __name__ == '__main__':
+    from models import resnext
+
+    do_check = True
+    do_benchmark = False
+    # trained weights (checkpoint of main_baseline) and a test video for the check, random weights and
+    # a synthetic video if empty
+    weight_path = ''
+    video_path = ''
+    net = resnext.resnext50(num_classes=3, sample_size=64, sample_duration=16)
+    if weight_path:
+        state_dict = torch.load(weight_path, map_location='cpu')['state_dict']
+        net.load_state_dict({k[len('module.'):] if k.startswith('module.') else k: v for k, v in state_dict.items()})
+    if do_check:
+        video = read_video_tensor(video_path, 33 * 8, 64) if video_path else None
+        check_window_sharing(net, video=video)
+    if do_benchmark:
+        benchmark_window_sharing(net)
@@ -0,0 +1,284 @@
+import time
+import numpy as np
+import torch
+
+# label : 2 = cut, 1 = gradual (cut when train_data_type == 'cut'), 0 = background
+
+
+def _to_numpy(x):
+    if torch.is_tensor(x):
+        return x.detach().cpu().numpy()
+    return np.asarray(x)
+
+
+def _merge_clips(frame_pos, labels, sample_duration, new_wins):
+    """Merge of clip predictions (start frame of clip, label), each covering [start, start + sample_duration].
+    Predictions are walked in order of start, and one overlapping the last transition
+      - with the same label extends it,
+      - with another label, if new_wins(last_label, label) : cuts the last transition at its start and follows it,
+        else : follows the last transition from its end.
+    The end of the last transition is always the end of the previous prediction, so every decision only
+    depends on the previous prediction and all of them are computed at once.
+    """
+    labels = _to_numpy(labels).reshape(-1)
+    positive = np.flatnonzero(labels > 0)
+    starts = _to_numpy(frame_pos).reshape(-1)[positive].astype(np.int64)
+    labels = labels[positive].astype(np.int64)
+    order = np.argsort(starts, kind='mergesort')
+    starts, labels = starts[order], labels[order]
+    num = starts.shape[0]
+    if num == 0:
+        return []
+    ends = starts + sample_duration
+
+    overlap = np.zeros(num, dtype=bool)
+    overlap[1:] = starts[1:] <= ends[:-1]
+    conflict = np.zeros(num, dtype=bool)
+    conflict[1:] = overlap[1:] & (labels[1:] != labels[:-1])
+    wins = np.zeros(num, dtype=bool)
+    wins[1:] = new_wins(labels[:-1], labels[1:])
+
+    first = np.flatnonzero(~overlap | conflict)
+    first[0] = 0
+    last = np.concatenate((first[1:] - 1, [num - 1]))
+
+    res_start = starts[first].copy()
+    lose = conflict[first] & ~wins[first]
+    res_start[lose] = ends[first[lose] - 1]
+    res_end = ends[last].copy()
+    cut_by_next = conflict[first[1:]] & wins[first[1:]]
+    res_end[:-1][cut_by_next] = starts[first[1:]][cut_by_next]
+
+    return list(zip(res_start.tolist(), res_end.tolist(), labels[first].tolist()))
+
+
+def merge_latest(frame_pos, labels, sample_duration, **kwargs):
+    """the later transition wins"""
+    return _merge_clips(frame_pos, labels, sample_duration, lambda last, new: np.ones(new.shape, dtype=bool))
+
+
+def merge_cut(frame_pos, labels, sample_duration, **kwargs):
+    """cut wins over gradual"""
+    return _merge_clips(frame_pos, labels, sample_duration, lambda last, new: last < new)
+
+
+def merge_gradual(frame_pos, labels, sample_duration, **kwargs):
+    """gradual wins over cut"""
+    return _merge_clips(frame_pos, labels, sample_duration, lambda last, new: last > new)
+
+
+def merge_origin(frame_pos, labels, sample_duration, **kwargs):
+    """runs of the same label over consecutive clips (clip stride : sample_duration / 2)"""
+    labels = _to_numpy(labels).reshape(-1).astype(np.int64)
+    if labels.shape[0] == 0:
+        return []
+    begin = np.concatenate(([0], np.flatnonzero(np.diff(labels)) + 1))
+    end = np.concatenate((begin[1:], [labels.shape[0]])) - 1
+    keep = labels[begin] > 0
+    begin, end = begin[keep], end[keep]
+    begin_frame = (begin * sample_duration / 2 + 1).astype(np.int64)
+    end_frame = (end * sample_duration / 2 + 16 + 1).astype(np.int64)
+    return list(zip(begin_frame.tolist(), end_frame.tolist(), labels[begin].tolist()))
+
+
+def merge_multiloss(frame_pos, labels, sample_duration, train_data_type='normal', **kwargs):
+    """bars of multiloss detector [start, end], sorted by start.
+    cut bars are kept as they are, gradual bars closer than 8 frames are joined,
+    and a gradual overlapping a transition of another label is cut around it.
+    Each step depends on the transitions inserted before, so this one stays a loop, over plain lists.
+    """
+    frame_pos = _to_numpy(frame_pos).reshape(-1, 2).astype(np.int64).tolist()
+    labels = _to_numpy(labels).reshape(-1).astype(np.int64).tolist()
+    final_res = list()
+    for (start, end), label in zip(frame_pos, labels):
+        if label <= 0 or start >= end:
+            continue
+        if len(final_res) == 0:
+            final_res.append((start, end, label))
+            continue
+
+        last_start, last_end, last_label = final_res[-1]
+        if label == 2 or (label == 1 and train_data_type == 'cut'):
+            final_res.append((start, end, label))
+        elif last_label == label:
+            if (start - last_end) <= 8:
+                final_res[-1] = (last_start, end, label)
+            else:
+                final_res.append((start, end, label))
+        # 안 겹칠 경우
+        elif last_end < start:
+            final_res.append((start, end, label))
+        elif end < last_start:
+            final_res.insert(-1, (start, end, label))
+        # 겹칠 경우
+        elif last_start <= start <= last_end < end:
+            final_res[-1] = (last_start, start - 1, last_label)
+            final_res.append((start, end, label))
+        elif start <= last_start <= end < last_end:
+            final_res[-1] = (start, end, label)
+            final_res.append((end + 1, last_end, last_label))
+        elif start <= last_start < last_end <= end:
+            final_res[-1] = (start, end, label)
+    return final_res
+
+
+merge_policies = {
+    'latest': merge_latest,
+    'cut': merge_cut,
+    'gradual': merge_gradual,
+    'origin': merge_origin,
+    'multiloss': merge_multiloss,
+}
+
+
+def merge_transitions(frame_pos, labels, sample_duration, policy='latest', train_data_type='normal'):
+    """predictions > list of (start, end, label) transitions"""
+    assert policy in merge_policies, 'merge policy in {}'.format(list(merge_policies.keys()))
+    return merge_policies[policy](frame_pos, labels, sample_duration, train_data_type=train_data_type)
+
+
+def merge_reference(frame_pos, labels, sample_duration, policy='latest', train_data_type='normal'):
+    """former main_baseline.get_result, one prediction at a time. used to check the merge policies"""
+    do_origin = policy == 'origin'
+    cut_priority = policy == 'cut'
+    gradual_priority = policy == 'gradual'
+    train_type = train_data_type
+    final_res = list()
+    if not do_origin:
+        for i, label in enumerate(labels):
+            if label > 0:
+                if policy != 'multiloss':
+                    start = int(frame_pos[i])
+                    if len(final_res) == 0:
+                        final_res.append((start, start + sample_duration, label))
+                    else:
+                        last_start = final_res[-1][0]
+                        last_end = final_res[-1][1]
+                        last_label = final_res[-1][2]
+                        if last_end < start:
+                            final_res.append((start, start + sample_duration, label))
+                        else:
+                            if cut_priority:
+                                if last_label == label:
+                                    final_res[-1] = (last_start, start + sample_duration, label)
+                                elif last_label < label:
+                                    final_res[-1] = (last_start, start, last_label)
+                                    final_res.append((start, start + sample_duration, label))
+                                else:
+                                    final_res.append((last_end, start + sample_duration, label))
+                            elif gradual_priority:
+                                if last_label == label:
+                                    final_res[-1] = (last_start, start + sample_duration, label)
+                                elif last_label > label:
+                                    final_res[-1] = (last_start, start, last_label)
+                                    final_res.append((start, start + sample_duration, label))
+                                else:
+                                    final_res.append((last_end, start + sample_duration, label))
+                            else:
+                                if last_label == label:
+                                    final_res[-1] = (last_start, start + sample_duration, label)
+                                else:
+                                    final_res[-1] = (last_start, start, last_label)
+                                    final_res.append((start, start + sample_duration, label))
+                else:
+                    start, end = int(frame_pos[i][0]), int(frame_pos[i][1])
+                    if start < end:
+                        if len(final_res) == 0:
+                            final_res.append((start, end, label))
+                        else:
+                            last_start = final_res[-1][0]
+                            last_end = final_res[-1][1]
+                            last_label = final_res[-1][2]
+                            if label == 2 or (label == 1 and train_type == 'cut'):
+                                final_res.append((start, end, label))
+                            else:
+                                if last_label == label:
+                                    if (start - last_end) <= 8:
+                                        final_res[-1] = (last_start, end, label)
+                                    else:
+                                        final_res.append((start, end, label))
+                                else:
+                                    if last_end < start or end < last_start:
+                                        if last_end < start:
+                                            final_res.append((start, end, label))
+                                        else:
+                                            final_res.insert(-1, (start, end, label))
+                                    else:
+                                        if last_start <= start <= last_end < end:
+                                            final_res[-1] = (last_start, start - 1, last_label)
+                                            final_res.append((start, end, label))
+                                        elif start <= last_start <= end < last_end:
+                                            final_res[-1] = (start, end, label)
+                                            final_res.append((end + 1, last_end, last_label))
+                                        elif start <= last_start < last_end <= end:
+                                            final_res[-1] = (start, end, label)
+                                        else:
+                                            final_res[-1] = (last_start, last_end, last_label)
+    else:
+        i = 0
+        while i < len(labels):
+            if labels[i] > 0:
+                label = labels[i]
+                begin = i
+                i += 1
+                while i < len(labels) and labels[i] == labels[i - 1]:
+                    i += 1
+                end = i - 1
+                begin_frame = int(begin * sample_duration / 2 + 1)
+                end_frame = int(end * sample_duration / 2 + 16 + 1)
+                final_res.append((begin_frame, end_frame, label))
+            else:
+                i += 1
+    return final_res
+
+
+def random_predictions(num, policy, sample_duration=16, rng=np.random):
+    """synthetic test video : clip predictions at stride sample_duration / 2, or multiloss bars sorted by start"""
+    if policy == 'multiloss':
+        starts = np.sort(rng.randint(0, num * 8 + 1, num))
+        frame_pos = np.stack((starts, starts + rng.randint(-1, 20, num)), 1)
+        labels = rng.randint(1, 3, num)
+    else:
+        frame_pos = np.arange(num) * (sample_duration // 2)
+        labels = rng.choice(3, num, p=[0.6, 0.2, 0.2])
+    return frame_pos, labels
+
+
+def check_policies(trial=2000, sample_duration=16, seed=0):
+    """random predictions : every policy gives the same transitions as merge_reference()"""
+    rng = np.random.RandomState(seed)
+    for policy in merge_policies:
+        for train_data_type in ['normal', 'cut']:
+            for _ in range(trial):
+                frame_pos, labels = random_predictions(rng.randint(0, 40), policy, sample_duration, rng)
+                if policy != 'multiloss' and rng.rand() < 0.5:
+                    # irregular clip starts
+                    frame_pos = np.sort(rng.randint(0, len(labels) * 10 + 1, len(labels)))
+                expected = merge_reference(frame_pos, labels.tolist(), sample_duration, policy, train_data_type)
+                expected = [(int(s), int(e), int(l)) for s, e, l in expected]
+                res = merge_transitions(frame_pos, labels, sample_duration, policy, train_data_type)
+                assert res == expected, (policy, train_data_type, frame_pos, labels, res, expected)
+        print('[INFO] merge policy {} : same as reference'.format(policy), flush=True)
+
+
+def benchmark_policies(num=100000, sample_duration=16, seed=0):
+    rng = np.random.RandomState(seed)
+    for policy in merge_policies:
+        frame_pos, labels = random_predictions(num, policy, sample_duration, rng)
+        start = time.time()
+        merge_reference(torch.from_numpy(frame_pos), torch.from_numpy(labels), sample_duration, policy)
+        reference_time = time.time() - start
+        start = time.time()
+        merge_transitions(frame_pos, labels, sample_duration, policy)
+        policy_time = time.time() - start
+        print('[INFO] {} ({} predictions) : reference {:.3f}s, merge {:.3f}s'.format(
+            policy, num, reference_time, policy_time), flush=True)
+
+
+if __name__ == '__main__':
+    do_check = True
+    do_benchmark = False
+    if do_check:
+        check_policies()
+    if do_benchmark:
+        benchmark_policies()
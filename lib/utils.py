@@ -1,4 +1,5 @@
 import csv
+import numpy as np
 import torch
 import torch.nn as nn
 
@@ -174,7 +175,7 @@ def log_sum_exp(x):
 # Original author: Francisco Massa:
 # https://github.com/fmassa/object-detection.torch
 # Ported to PyTorch by Max deGroot (02/01/2017)
-def nms(bars, scores, overlap=0.5, top_k=0):
+def nms(bars, scores, overlap=0.5, top_k=0, check_policy=1):
     """Apply non-maximum suppression at test time to avoid detecting too many
     overlapping bounding boxes for a given object.
     Args:
@@ -182,6 +183,7 @@ def nms(bars, scores, overlap=0.5, top_k=0):
         scores: (tensor) The class predscores for the img, Shape:[num_priors].
         overlap: (float) The overlap thresh for suppressing unnecessary boxes.
         top_k: (int) The Maximum number of box preds to consider.
+        check_policy: (int) 1 : IoU only, 2 : and start[i] - ss != 1, 3 : and not (start[i] - ss == 1 and IoU == 0.5)
     Return:
         The indices of the kept boxes with respect to num_priors.
     """
@@ -191,7 +193,7 @@ def nms(bars, scores, overlap=0.5, top_k=0):
     # overlap = nms_threshold(0.45) / top_k = 5(default)
     keep = scores.new_zeros(scores.size(0)).to(torch.long)
     if bars.numel() == 0:   # number of elements
-        return keep
+        return keep, 0
     start = bars[:, 0]      # [num]
     end = bars[:, 1]        # [num]
     length = end - start + 1    # [num]
@@ -223,7 +225,6 @@ def nms(bars, scores, overlap=0.5, top_k=0):
         union = length[i] + rem_lengths - inter
         IoU = inter / union  # store result in iou
 
-        check_policy = 1
         # keep elements with an IoU <= overlap
         check_iou = IoU.le(overlap)
 
@@ -234,23 +235,303 @@ def nms(bars, scores, overlap=0.5, top_k=0):
             # nms = 0.67 and
             # keep elements with start[i] - ss != 1
             check_location = (ss - start[i].item()) != 1
-            check_overlap = check_iou + check_location
+            check_overlap = check_iou & check_location
 
-            idx = idx[check_overlap == 2]
+            idx = idx[check_overlap]
         else:
             # nms = 0.6 and
             # keep elements with not (start[i] - ss == 1 and IoU == 0.5)
             check_location = (ss - start[i].item()) == 1
             check_iou_2 = IoU == 0.5
-            check_exception = check_location + check_iou_2 != 2
+            check_exception = ~(check_location & check_iou_2)
 
-            check_overlap = check_iou + check_exception
+            check_overlap = check_iou & check_exception
 
-            idx = idx[check_overlap == 2]
+            idx = idx[check_overlap]
 
     return keep, count
 
 
+def nms_batched(bars, scores, classes, overlap=0.5, check_policy=1, max_cluster=32):
+    """nms() for all classes at once, same result as calling nms() for each class.
+    Bars of different classes are moved apart by a class offset, and bars are grouped into clusters
+    of overlapping bars (suppression never crosses clusters).
+    Clusters of up to max_cluster bars : the IoU matrices of clusters of similar size are computed
+    as one [cluster_num, M, M] batch, and the greedy suppression is solved column by column
+    (M steps over the whole batch).
+    Larger clusters (e.g. a long run of overlapping bars) : only the suppressing neighbour pairs are compared
+    (_nms_pairs, memory linear in the number of pairs) and the greedy suppression walks them once in rank order.
+    Args:
+        bars: [num, 2], scores: [num], classes: [num]
+    Return:
+        indices of the kept bars, in order of class and then score (descending)
+    """
+    device = bars.device if torch.is_tensor(bars) else torch.device('cpu')
+    bars = bars.detach().cpu().numpy() if torch.is_tensor(bars) else np.asarray(bars)
+    scores = scores.detach().cpu().numpy() if torch.is_tensor(scores) else np.asarray(scores)
+    classes = classes.detach().cpu().numpy() if torch.is_tensor(classes) else np.asarray(classes)
+    num = scores.shape[0]
+    if num == 0:
+        return torch.zeros(0, dtype=torch.long, device=device)
+
+    start = bars[:, 0]
+    end = bars[:, 1]
+    classes = classes.astype(np.int64)
+
+    rank = _nms_rank(scores, classes)
+    shifted_start, shifted_reach = _nms_shift(start, end, classes)
+
+    # a new cluster where a bar starts after every previous bar has ended
+    by_start = np.argsort(shifted_start, kind='mergesort')
+    max_reach = np.maximum.accumulate(shifted_reach[by_start])
+    new_cluster = np.ones(num, dtype=bool)
+    new_cluster[1:] = shifted_start[by_start][1:] > max_reach[:-1]
+    cluster = np.empty(num, dtype=np.int64)
+    cluster[by_start] = np.cumsum(new_cluster) - 1
+    cluster_num = int(cluster.max()) + 1
+    cluster_size = np.bincount(cluster, minlength=cluster_num)
+
+    kept = list()
+    large = cluster_size > max_cluster
+    if large.any():
+        members = by_start[large[cluster[by_start]]]
+        src, dst = _nms_pairs(start, end, rank, shifted_start[members], shifted_reach[members], members,
+                              overlap, check_policy)
+        keep = _nms_greedy(num, src, dst, rank)
+        kept.append(members[keep[members]])
+
+    # bars of each small cluster in rank order ; clusters are batched by size (power of 2) to limit padding
+    small_bar = np.flatnonzero(~large[cluster])
+    if small_bar.shape[0] != 0:
+        grouped = small_bar[np.lexsort((rank[small_bar], cluster[small_bar]))]
+        grouped_cluster = cluster[grouped]
+        cluster_begin = np.searchsorted(grouped_cluster, np.arange(cluster_num))
+        pos = np.arange(grouped.shape[0]) - cluster_begin[grouped_cluster]
+        size_bucket = np.ceil(np.log2(cluster_size)).astype(np.int64)
+
+        for bucket in np.unique(size_bucket[grouped_cluster]):
+            bucket_cluster = np.flatnonzero((size_bucket == bucket) & ~large)
+            cluster_row = np.full(cluster_num, -1, dtype=np.int64)
+            cluster_row[bucket_cluster] = np.arange(bucket_cluster.shape[0])
+            in_bucket = size_bucket[grouped_cluster] == bucket
+
+            member = np.full((bucket_cluster.shape[0], int(cluster_size[bucket_cluster].max())), -1, dtype=np.int64)
+            member[cluster_row[grouped_cluster[in_bucket]], pos[in_bucket]] = grouped[in_bucket]
+            keep = _nms_cluster_batch(start, end, member, overlap, check_policy)
+            kept.append(member[keep])
+
+    kept = np.concatenate(kept)
+    kept = kept[np.argsort(rank[kept], kind='mergesort')]
+    return torch.from_numpy(kept).to(device)
+
+
+def _nms_rank(scores, classes):
+    """rank of each bar : class in ascending order, then score in descending order.
+    scores are sorted per class with the same torch sort as nms(), so ties are ranked the same
+    """
+    order = list()
+    for cls in np.unique(classes):
+        cls_idx = np.flatnonzero(classes == cls)
+        _, idx = torch.from_numpy(scores[cls_idx]).sort(0)
+        order.append(cls_idx[idx.numpy()[::-1]])
+    order = np.concatenate(order)
+    rank = np.empty(scores.shape[0], dtype=np.int64)
+    rank[order] = np.arange(scores.shape[0])
+    return rank
+
+
+def _nms_shift(start, end, classes):
+    """start and reach of each bar moved apart by a class offset.
+    reach = max(start, end) + 1 : a bar can only suppress the bars which start up to its reach
+    (overlap, or start[j] - start[i] == 1 of check_policy 2 and 3)
+    """
+    span = max(float(np.max(np.maximum(start, end))) - float(np.min(start)), 0.) + 3.
+    offset = (classes - classes.min()) * span
+    shifted_start = start.astype(np.float64) + offset
+    shifted_reach = np.maximum(start, end).astype(np.float64) + 1 + offset
+    return shifted_start, shifted_reach
+
+
+def _nms_pairs(start, end, rank, sorted_start, sorted_reach, members, overlap, check_policy, chunk_size=1 << 20):
+    """suppressing pairs (src, dst) of the bars members (sorted by shifted start : sorted_start, sorted_reach),
+    src is ranked before dst. The neighbours of the k-th member are the following members up to the last one
+    starting before its reach (searchsorted), compared chunk_size pairs at a time with the same operations
+    as nms(), only suppressing pairs are kept.
+    """
+    num = members.shape[0]
+    if num == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    length = end - start + 1
+    # neighbours of the k-th member : k + 1 .. hi[k] - 1
+    hi = np.maximum(np.searchsorted(sorted_start, sorted_reach, side='right'), np.arange(1, num + 1))
+    pair_num = hi - np.arange(1, num + 1)
+    pair_end = np.cumsum(pair_num)
+
+    src, dst = list(), list()
+    first = 0
+    while first < num:
+        last = int(np.searchsorted(pair_end, (pair_end[first - 1] if first > 0 else 0) + chunk_size, side='right'))
+        last = min(max(last, first + 1), num)
+        counts = pair_num[first:last]
+        a = np.repeat(np.arange(first, last), counts)
+        b = a + 1 + np.arange(a.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+        a, b = members[a], members[b]
+        # i : higher ranked (kept) bar, j : the other one
+        a_first = rank[a] < rank[b]
+        i = np.where(a_first, a, b)
+        j = np.where(a_first, b, a)
+
+        # same operations as nms()
+        ss = np.maximum(start[i], start[j])
+        inter = np.clip(np.minimum(end[i], end[j]) - ss + 1, 0, None)
+        union = length[i] + length[j] - inter
+        with np.errstate(divide='ignore', invalid='ignore'):
+            iou = inter / union
+        suppress = ~(iou <= np.asarray(overlap, dtype=iou.dtype))
+        if check_policy == 2:
+            suppress |= (ss - start[i]) == 1
+        elif check_policy == 3:
+            suppress |= ((ss - start[i]) == 1) & (iou == 0.5)
+        src.append(i[suppress])
+        dst.append(j[suppress])
+        first = last
+    return np.concatenate(src), np.concatenate(dst)
+
+
+def _nms_greedy(num, src, dst, rank):
+    """keep mask [num] of the greedy suppression on the suppressing pairs (src ranked before dst) :
+    bars with suppressing pairs are visited once in rank order, and a kept bar removes its dst bars,
+    so every pair is visited at most once
+    """
+    removed = np.zeros(num, dtype=bool)
+    if src.shape[0] == 0:
+        return ~removed
+    order = np.argsort(src, kind='mergesort')
+    dst = dst[order]
+    ptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=num)))).tolist()
+    suppressor = np.unique(src)
+    for i in suppressor[np.argsort(rank[suppressor], kind='mergesort')].tolist():
+        if not removed[i]:
+            removed[dst[ptr[i]:ptr[i + 1]]] = True
+    return ~removed
+
+
+def nms_sweep(bars, scores, classes, overlap=0.5, check_policy=1, chunk_size=1 << 20):
+    """nms_batched() in memory linear in the number of neighbour pairs, for very long videos.
+    Bars are sorted by start (with class offset), so the bars a bar can suppress are the following ones
+    up to the first start after its reach, found by searchsorted (_nms_pairs).
+    Only those neighbour pairs are compared, chunk_size pairs at a time, and only suppressing pairs are kept.
+    The greedy suppression then visits the bars once in rank order (_nms_greedy) :
+    O(n log n + pairs) time, also for chains of bars each suppressing the next one.
+    Return:
+        indices of the kept bars, in order of class and then score (descending)
+    """
+    device = bars.device if torch.is_tensor(bars) else torch.device('cpu')
+    bars = bars.detach().cpu().numpy() if torch.is_tensor(bars) else np.asarray(bars)
+    scores = scores.detach().cpu().numpy() if torch.is_tensor(scores) else np.asarray(scores)
+    classes = classes.detach().cpu().numpy() if torch.is_tensor(classes) else np.asarray(classes)
+    num = scores.shape[0]
+    if num == 0:
+        return torch.zeros(0, dtype=torch.long, device=device)
+
+    start = bars[:, 0]
+    end = bars[:, 1]
+    classes = classes.astype(np.int64)
+    rank = _nms_rank(scores, classes)
+
+    shifted_start, shifted_reach = _nms_shift(start, end, classes)
+    by_start = np.argsort(shifted_start, kind='mergesort')
+    src, dst = _nms_pairs(start, end, rank, shifted_start[by_start], shifted_reach[by_start], by_start,
+                          overlap, check_policy, chunk_size)
+    keep = _nms_greedy(num, src, dst, rank)
+
+    kept = np.flatnonzero(keep)
+    kept = kept[np.argsort(rank[kept], kind='mergesort')]
+    return torch.from_numpy(kept).to(device)
+
+
+def _nms_cluster_batch(start, end, member, overlap, check_policy):
+    """keep mask [cluster_num, M] of clusters member [cluster_num, M] (bar indices in rank order, -1 : padding)"""
+    valid = member >= 0
+    size = member.shape[1]
+    s = np.where(valid, start[member], 0).astype(start.dtype)
+    e = np.where(valid, end[member], 0).astype(end.dtype)
+    length = e - s + 1
+    # pairwise, same operations as nms() : i is the kept bar, j the remaining one
+    ss = np.maximum(s[:, None, :], s[:, :, None])
+    inter = np.clip(np.minimum(e[:, None, :], e[:, :, None]) - ss + 1, 0, None)
+    union = length[:, :, None] + length[:, None, :] - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = inter / union
+    suppress = ~(iou <= np.asarray(overlap, dtype=iou.dtype))
+    if check_policy == 2:
+        suppress |= (ss - s[:, :, None]) == 1
+    elif check_policy == 3:
+        suppress |= ((ss - s[:, :, None]) == 1) & (iou == 0.5)
+    suppress &= np.triu(np.ones((size, size), dtype=bool), 1)
+    suppress &= valid[:, :, None] & valid[:, None, :]
+
+    # greedy in rank order : bar j is kept if no kept bar ranked before it suppresses it
+    keep = valid.copy()
+    for j in range(1, size):
+        keep[:, j] &= ~np.any(suppress[:, :j, j] & keep[:, :j], axis=1)
+    return keep
+
+
+def benchmark_nms(num_windows=2000, sample_duration=16, chain_num=32000, check=True):
+    """nms_batched() and nms_sweep() against the per-class nms() loop on CPU :
+    dense : the 26 default bars (lengths 2, 4, 8, 16) of every test window (stride sample_duration / 2),
+            2 classes and random scores, num_windows * 26 bars
+    chain : chain_num bars [i, i + 3] with scores falling over time, each bar suppresses the next one
+    check : also run the nms() loop (slow) and check that the kept bars are the same
+    """
+    import time
+    rng = np.random.RandomState(0)
+    default_bar = np.array([[s, s + l - 1] for l in [2, 4, 8, 16] for s in range(0, 16 - l + 1, max(l // 2, 1))],
+                           dtype=np.float32)
+    window_start = np.arange(num_windows, dtype=np.float32) * (sample_duration // 2)
+    dense_bars = (default_bar[None] + window_start.reshape(-1, 1, 1)).reshape(-1, 2)
+    dense_scores = rng.rand(dense_bars.shape[0]).astype(np.float32)
+    dense_classes = rng.randint(1, 3, dense_bars.shape[0]).astype(np.float32)
+    chain_start = np.arange(chain_num, dtype=np.float32)
+    cases = [('dense', dense_bars, dense_scores, dense_classes),
+             ('chain', np.stack((chain_start, chain_start + 3), 1), 1 - chain_start / chain_num,
+              np.ones(chain_num, dtype=np.float32))]
+
+    for name, bars, scores, classes in cases:
+        bars, scores, classes = torch.from_numpy(bars), torch.from_numpy(scores), torch.from_numpy(classes)
+        res = dict()
+        for fn_name, fn in [('batched', nms_batched), ('sweep', nms_sweep)]:
+            start = time.time()
+            res[fn_name] = fn(bars, scores, classes).tolist()
+            print('[INFO] nms {} {} bars : {} {:.1f} ms'.format(name, bars.size(0), fn_name,
+                                                               (time.time() - start) * 1000), flush=True)
+        if check:
+            start = time.time()
+            kept = list()
+            for cls in classes.unique().tolist():
+                cls_idx = torch.nonzero(classes == cls).view(-1)
+                ids, count = nms(bars[cls_idx], scores[cls_idx])
+                kept += cls_idx[ids[:count]].tolist()
+            print('[INFO] nms {} : loop {:.1f} ms, same result : {}'.format(
+                name, (time.time() - start) * 1000, res['batched'] == kept and res['sweep'] == kept), flush=True)
+
+
+def sort_descending_stable(scores):
+    """sort of the last dimension in descending order, equal scores kept in index order.
+    same as sort(descending=True, stable=True) of torch >= 1.9, by a pairwise comparison for short rows
+    (e.g. the default bars of a clip)
+    """
+    index = torch.arange(scores.size(-1), device=scores.device)
+    s_i = scores.unsqueeze(-1)
+    s_j = scores.unsqueeze(-2)
+    # [..., i, j] : j is ranked before i
+    before = s_j.gt(s_i) | (s_j.eq(s_i) & (index.view(1, -1) < index.view(-1, 1)))
+    rank = before.sum(-1)
+    idx = torch.empty_like(rank).scatter_(-1, rank, index.expand_as(rank).contiguous())
+    return scores.gather(-1, idx), idx
+
+
 def detection(out, sample_duration, num_classes, default_bar, conf_thresh, boundaries=None):
     loc, conf = out
     # frame_pos = torch.zeros(loc.size(0), loc.size(1), loc.size(2))
@@ -293,7 +574,7 @@ def detection(out, sample_duration, num_classes, default_bar, conf_thresh, bound
                 continue
             l_mask = c_mask.unsqueeze(1).expand_as(decoded_bars)  # [default_num, 2]
             bars = decoded_bars[l_mask].view(-1, 2)  # [num, 2]
-            v, idx = scores.sort(0, descending=True)  # sort in descending order
+            v, idx = sort_descending_stable(scores)  # sort in descending order, ties in index order
 
             count = 0
             if cl == 0:
@@ -340,11 +621,169 @@ def detection(out, sample_duration, num_classes, default_bar, conf_thresh, bound
     return output, pred_num
 
 
+def detection_batched(out, sample_duration, num_classes, default_bar, conf_thresh, boundaries=None):
+    """Same result as detection(), computed for the whole batch at once on the device of out.
+    output : [batch_size, num_classes, default_num, 3] (start, end, conf), sorted by conf in descending order
+    pred_num : [batch_size, num_classes], stays on the device
+    """
+    loc, conf = out
+    device = loc.device
+    default = default_bar.to(device)
+    batch_size = loc.size(0)
+    default_num = default.size(0)
+    threshold = 0.6
+    variances = [0.1, 0.2]
+
+    # decoding() for all default bars of all batch items : [batch_size, default_num, 2]
+    default = get_center_length(default)
+    center = loc[:, :, 0] * variances[0] * default[:, 1] + default[:, 0]
+    length = torch.exp(loc[:, :, 1] * variances[1]) * default[:, 1]
+    decoded_bars = torch.stack((center - (length - 1) / 2, center + (length - 1) / 2), -1)
+
+    conf_pred = conf.transpose(2, 1).detach()  # [batch_size, num_classes, default_num]
+    valid = conf_pred.gt(conf_thresh) & conf_pred.ge(threshold)
+    pred_num = valid.sum(2).int()
+
+    # stable like detection() : ties of the thresholded bars keep their index order
+    scores, idx = sort_descending_stable(conf_pred.masked_fill(~valid, -float('inf')))
+    bars = decoded_bars.detach().unsqueeze(1).expand(batch_size, num_classes, default_num, 2)
+    bars = bars.gather(2, idx.unsqueeze(-1).expand(batch_size, num_classes, default_num, 2))
+
+    if boundaries is not None:
+        bound_start = boundaries.to(device).float().view(-1, 1, 1, 1)
+    else:
+        bound_start = torch.zeros(batch_size, 1, 1, 1, device=device)
+    bound_end = bound_start + sample_duration - 1
+
+    # class > 0 : bars moved to the frame position of the clip, zeroed if out of the clip
+    frame_bars = torch.round(bars[:, 1:] + bound_start)
+    in_range = (frame_bars.ge(bound_start) & frame_bars.le(bound_end)).all(-1, keepdim=True)
+    frame_bars = frame_bars.masked_fill(~in_range, 0)
+    bars = torch.cat((bars[:, :1], frame_bars), 1)
+
+    output = torch.cat((bars, scores.unsqueeze(-1)), -1)
+    keep = torch.arange(default_num, device=device).view(1, 1, -1) < pred_num.unsqueeze(-1)
+    output = output.masked_fill(~keep.unsqueeze(-1), 0)
+
+    return output, pred_num
+
+
+def benchmark_detection(default_bar, batch_size=8, num_classes=3, sample_duration=16, conf_thresh=0.01, repeat=20):
+    """detection() vs detection_batched() on random predictions; checks that both give the same result,
+    also with scores quantised to 0.05 (tied scores)
+    """
+    import time
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    default_num = default_bar.size(0)
+    loc = torch.randn(batch_size, default_num, 2, device=device)
+    conf = torch.softmax(torch.randn(batch_size, default_num, num_classes, device=device) * 3, -1)
+    boundaries = torch.arange(batch_size, device=device) * int(sample_duration / 2)
+    out = (loc, conf)
+
+    res = dict()
+    for name, fn in [('loop', detection), ('batched', detection_batched)]:
+        output, pred_num = fn(out, sample_duration, num_classes, default_bar, conf_thresh, boundaries=boundaries)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        start = time.time()
+        for _ in range(repeat):
+            output, pred_num = fn(out, sample_duration, num_classes, default_bar, conf_thresh, boundaries=boundaries)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        res[name] = (output, pred_num.cpu(), (time.time() - start) / repeat)
+        print('[INFO] detection {} : {:.3f} ms/batch'.format(name, res[name][2] * 1000), flush=True)
+
+    same = torch.equal(res['loop'][1], res['batched'][1]) \
+        and torch.allclose(res['loop'][0], res['batched'][0], atol=1e-5)
+    print('[INFO] same result : {}, speedup : x{:.1f}'.format(same, res['loop'][2] / res['batched'][2]), flush=True)
+
+    tied = (loc, torch.round(conf * 20) / 20)
+    tied_res = [fn(tied, sample_duration, num_classes, default_bar, conf_thresh, boundaries=boundaries)
+                for fn in [detection, detection_batched]]
+    same = torch.equal(tied_res[0][1].cpu(), tied_res[1][1].cpu()) \
+        and torch.allclose(tied_res[0][0], tied_res[1][0], atol=1e-5)
+    print('[INFO] same result with tied scores : {}'.format(same), flush=True)
+    return res
+
+
+def match_default_bars(truths, default_bar):
+    """One ground truth per clip against all default bars, for a batch of clips.
+    truths : [batch_size, 2] (start, end), default_bar : [default_bar_num, 2]
+    return overlaps : [batch_size, default_bar_num] IoU, best_prior_idx : [batch_size],
+           best_truth_overlap : overlaps with the best prior set to 2,
+           loc : [batch_size, default_bar_num, 2] encoding(truth, default_bar=default_bar)
+    """
+    variances = [0.1, 0.2]
+    truths = truths.float()
+
+    # jaccard index, same operations as cal_iou(use_default=True)
+    inter_start = torch.max(truths[:, 0].view(-1, 1), default_bar[:, 0].view(1, -1))
+    inter_end = torch.min(truths[:, 1].view(-1, 1), default_bar[:, 1].view(1, -1))
+    inter = torch.clamp(inter_end - inter_start + 1, min=0)
+    area_a = (truths[:, 1] - truths[:, 0] + 1).view(-1, 1)
+    area_b = (default_bar[:, 1] - default_bar[:, 0] + 1).view(1, -1)
+    overlaps = inter / (area_a + area_b - inter)
+
+    # (Bipartite Matching) with one ground truth, every default bar matches it
+    # and the best prior of the ground truth is always kept
+    _, best_prior_idx = overlaps.max(1, keepdim=True)
+    best_truth_overlap = overlaps.scatter(1, best_prior_idx, 2)
+
+    # same operations as encoding()
+    truths_cl = get_center_length(truths)
+    default_cl = get_center_length(default_bar)
+    center = (truths_cl[:, 0].view(-1, 1) - default_cl[:, 0].view(1, -1)) \
+        / (variances[0] * default_cl[:, 1].view(1, -1))
+    length = torch.log(truths_cl[:, 1].view(-1, 1) / default_cl[:, 1].view(1, -1)) / variances[1]
+    loc = torch.stack((center, length), 2)
+
+    return overlaps, best_prior_idx.view(-1), best_truth_overlap, loc
+
+
+class DefaultBarTable(nn.Module):
+    """match_default_bars() of every integer ground truth [start, end], 0 <= start <= end < sample_duration,
+    computed once for a default bar set. Row of [start, end] : start * sample_duration + end.
+    Tables are buffers, so they follow the owner module with .to(device).
+    """
+    def __init__(self, default_bar, sample_duration):
+        super(DefaultBarTable, self).__init__()
+        self.sample_duration = sample_duration
+        frames = torch.arange(sample_duration).float()
+        truths = torch.stack((frames.view(-1, 1).expand(sample_duration, sample_duration),
+                              frames.view(1, -1).expand(sample_duration, sample_duration)), 2).view(-1, 2)
+        overlaps, best_prior_idx, best_truth_overlap, loc = match_default_bars(truths, default_bar.float())
+        # rows with start > end are never looked up
+        self.register_buffer('overlaps', overlaps)
+        self.register_buffer('best_prior_idx', best_prior_idx)
+        self.register_buffer('best_truth_overlap', best_truth_overlap)
+        self.register_buffer('loc', loc)
+
+    def index(self, truths):
+        """row of each ground truth, or None if one of them is not an integer interval inside the clip"""
+        start, end = truths[:, 0], truths[:, 1]
+        inside = (start == torch.round(start)) & (end == torch.round(end)) \
+            & (start >= 0) & (start <= end) & (end < self.sample_duration)
+        if not bool(inside.all()):
+            return None
+        return start.long() * self.sample_duration + end.long()
+
+    def lookup(self, truths):
+        """same result as match_default_bars(truths, default_bar) by a gather, or None (see index())"""
+        idx = self.index(truths.float())
+        if idx is None:
+            return None
+        idx = idx.to(self.loc.device)
+        return self.overlaps[idx], self.best_prior_idx[idx], self.best_truth_overlap[idx], self.loc[idx]
+
+
 class Configure:
-    def __init__(self, in_channel=2048, sample_duration=16, data_type='normal'):
+    def __init__(self, in_channel=2048, sample_duration=16, data_type='normal', policy='first'):
         assert sample_duration in [8, 16, 32]
+        assert policy in ['first', 'second']
         self.sample_duration = sample_duration
         self.data_type = data_type
+        self.policy = policy
+        self.bar_table = None
 
         channel_l = dict()
         # channel_l[8] = [(2048, 512, 1024), (1024, 256, 512)]
@@ -363,10 +802,47 @@ class Configure:
     def get_channel_list(self):
         return self.channel_l
 
+    def get_default_bar(self):
+        """default bars [default_bar_num, 2] (start, end) of the MultiDetector layers, in the order of its outputs.
+        cut layer (data_type normal, cut) : bars of length 2, stride 1
+        gradual layers (data_type normal, gradual) : bars of length 2 * stride, stride 2, 4, ...
+            first  : one layer per entry of the channel list (stride 2 ** (idx + 1))
+            second : strides 2, 4, 8
+        a layer has (sample_duration - 2 * stride) // stride + 1 output positions, layers without any are skipped
+        """
+        bars = list()
+        if self.data_type in ['normal', 'cut']:
+            bars += [[start, start + 1] for start in range(self.sample_duration - 1)]
+        if self.data_type in ['normal', 'gradual']:
+            if self.policy == 'first':
+                strides = [2 ** (idx + 1) for idx in range(len(self.channel_l))]
+            else:
+                strides = [2, 4, 8]
+            for stride in strides:
+                for pos in range((self.sample_duration - 2 * stride) // stride + 1):
+                    bars += [[pos * stride, pos * stride + 2 * stride - 1]]
+        return torch.Tensor(bars)
+
+    def get_bar_table(self):
+        """DefaultBarTable of get_default_bar(), built once per Configure"""
+        if self.bar_table is None:
+            self.bar_table = DefaultBarTable(self.get_default_bar(), self.sample_duration)
+        return self.bar_table
+
 
 if __name__ == '__main__':
-    c_16 = Configure(16, policy='first')
-    c_32 = Configure(32, policy='first')
+    do_nms_benchmark = False
+    if do_nms_benchmark:
+        benchmark_nms()
+
+    do_detection_benchmark = False
+    if do_detection_benchmark:
+        # default bars of every length 2, 4, 8, 16 with stride length / 2 in a 16 frame clip
+        bars = [[float(s), float(s + l - 1)] for l in [2, 4, 8, 16] for s in range(0, 16 - l + 1, max(l // 2, 1))]
+        benchmark_detection(torch.Tensor(bars), batch_size=64)
+
+    c_16 = Configure(sample_duration=16, policy='first')
+    c_32 = Configure(sample_duration=32, policy='first')
     c_new = Configure(policy='second')
     default_bar_16 = c_16.get_default_bar()
     default_bar_32 = c_32.get_default_bar()
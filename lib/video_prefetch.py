@@ -0,0 +1,159 @@
+import time
+import queue
+import traceback
+import collections
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data.dataloader import default_collate
+
+
+def _video_worker(dataset_class, args, kwargs, batch_size, out_queue, done):
+    """builds the dataset of one video, puts (number of items, number of batches), its batches, then None.
+    the worker stays alive until done is set : shared tensors are received through file descriptors of this process
+    """
+    try:
+        torch.set_num_threads(1)
+        dataset = dataset_class(*args, **kwargs)
+        num_items = len(dataset)
+        out_queue.put((num_items, (num_items + batch_size - 1) // batch_size))
+        for start in range(0, num_items, batch_size):
+            out_queue.put(default_collate([dataset[i] for i in range(start, min(start + batch_size, num_items))]))
+        out_queue.put(None)
+    except Exception:
+        out_queue.put(RuntimeError(traceback.format_exc()))
+    done.wait()
+
+
+class VideoBatches:
+    """Batches of one video, read from the queue of its worker process. used as the test_data_loader of test()"""
+    def __init__(self, process, out_queue, done):
+        self.process = process
+        self.queue = out_queue
+        self.done = done
+        self.num_items, self.num_batches = self._get()
+
+    def _get(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError('video worker exited (exit code {})'.format(self.process.exitcode))
+                continue
+            if isinstance(item, Exception):
+                raise item
+            return item
+
+    def __len__(self):
+        return self.num_batches
+
+    def __iter__(self):
+        while not self.done.is_set():
+            batch = self._get()
+            if batch is None:
+                self.done.set()
+                break
+            yield batch
+        self.close()
+
+    def close(self):
+        if not self.done.is_set() and self.process.is_alive():
+            self.process.terminate()
+        self.done.set()
+        self.process.join()
+
+
+class VideoPrefetcher:
+    """Test videos decoded and preprocessed in worker processes, prefetch_videos videos ahead of the one in inference.
+    Each worker builds dataset_class(*args, **kwargs) of one video and hands its batches over through a bounded
+    torch.multiprocessing queue (tensors are moved to shared memory, only their handles are pickled).
+    Batches are the ones of DataLoader(dataset, batch_size) without shuffle, in the same order,
+    so the results are the same as a sequential test.
+    Iterating yields VideoBatches of each video, in the order of video_args.
+    """
+    def __init__(self, dataset_class, video_args, batch_size, prefetch_videos=2, queue_size=4):
+        self.dataset_class = dataset_class
+        self.video_args = video_args
+        self.batch_size = batch_size
+        self.prefetch_videos = prefetch_videos
+        self.queue_size = queue_size
+        self.pending = collections.deque()
+
+    def _start(self, args, kwargs):
+        out_queue = mp.Queue(maxsize=self.queue_size)
+        done = mp.Event()
+        process = mp.Process(target=_video_worker,
+                             args=(self.dataset_class, args, kwargs, self.batch_size, out_queue, done), daemon=True)
+        process.start()
+        self.pending.append((process, out_queue, done))
+
+    def __len__(self):
+        return len(self.video_args)
+
+    def __iter__(self):
+        next_video = 0
+        try:
+            for idx in range(len(self.video_args)):
+                # the current video and prefetch_videos videos after it are processed at the same time
+                while next_video < len(self.video_args) and next_video <= idx + self.prefetch_videos:
+                    self._start(*self.video_args[next_video])
+                    next_video += 1
+                batches = VideoBatches(*self.pending.popleft())
+                yield batches
+                batches.close()
+        finally:
+            self.close()
+
+    def close(self):
+        while len(self.pending) != 0:
+            process, _, done = self.pending.popleft()
+            if process.is_alive():
+                process.terminate()
+            done.set()
+            process.join()
+
+
+class _SyntheticVideo(torch.utils.data.Dataset):
+    """test dataset of a random video : (clip, start frame) every sample_duration / 2 frames, slow to build"""
+    def __init__(self, seed, num_frame=200, sample_duration=16, size=32, build_time=0.5):
+        time.sleep(build_time)
+        generator = torch.Generator().manual_seed(seed)
+        self.frames = torch.rand(3, num_frame, size, size, generator=generator)
+        self.sample_duration = sample_duration
+
+    def __len__(self):
+        return (self.frames.size(1) - self.sample_duration) // (self.sample_duration // 2) + 1
+
+    def __getitem__(self, idx):
+        start = idx * (self.sample_duration // 2)
+        return self.frames[:, start:start + self.sample_duration], start
+
+
+def check_prefetch(num_videos=6, batch_size=5, prefetch_videos=2):
+    """batches of VideoPrefetcher against DataLoader, and the time of both with a slow dataset build"""
+    video_args = [((seed,), {'num_frame': 100 + 17 * seed}) for seed in range(num_videos)]
+
+    start = time.time()
+    expected = list()
+    for args, kwargs in video_args:
+        loader = torch.utils.data.DataLoader(_SyntheticVideo(*args, **kwargs), batch_size=batch_size)
+        expected.append([(clip.clone(), boundary.clone()) for clip, boundary in loader])
+    sequential_time = time.time() - start
+
+    start = time.time()
+    for batches, expected_batches in zip(VideoPrefetcher(_SyntheticVideo, video_args, batch_size, prefetch_videos),
+                                         expected):
+        assert len(batches) == len(expected_batches)
+        res = list(batches)
+        assert len(res) == len(expected_batches)
+        for (clip, boundary), (expected_clip, expected_boundary) in zip(res, expected_batches):
+            assert torch.equal(clip, expected_clip) and torch.equal(boundary, expected_boundary)
+    prefetch_time = time.time() - start
+    print('[INFO] prefetch : same batches as DataLoader, sequential {:.2f}s, prefetch_videos {} {:.2f}s'.format(
+        sequential_time, prefetch_videos, prefetch_time), flush=True)
+
+
+if __name__ == '__main__':
+    do_check = True
+    if do_check:
+        check_prefetch()
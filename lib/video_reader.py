@@ -0,0 +1,104 @@
+import time
+import cv2
+
+
+class VideoReader:
+    """Frames of a video decoded by OpenCV, only for the frames and the resolution which are used.
+    size       : (width, height), frames are resized right after retrieve() (OpenCV cannot downscale while decoding),
+                 so no full resolution frame is kept
+    step       : only every step-th frame is retrieved (converted to BGR), the frames in between are grab()bed
+    start, end : frame range [start, end), start is reached by seeking
+    Keyframe flags are not exposed by OpenCV, so there is no keyframe-only mode, step is the cheap alternative.
+    Iterating yields BGR numpy arrays, indexed() yields (frame index, frame).
+    num_frame is the number of frames walked through (grabbed or retrieved) by the last iteration.
+    """
+    def __init__(self, video_path, size=None, step=1, start=0, end=None, interpolation=cv2.INTER_AREA):
+        assert step >= 1
+        self.video_path = video_path
+        self.size = tuple(size) if size is not None else None
+        self.step = step
+        self.start = start
+        self.end = end
+        self.interpolation = interpolation
+        self.num_frame = 0
+
+    def _property(self, prop):
+        cap = cv2.VideoCapture(self.video_path)
+        value = cap.get(prop)
+        cap.release()
+        return value
+
+    @property
+    def fps(self):
+        return self._property(cv2.CAP_PROP_FPS)
+
+    @property
+    def frame_count(self):
+        """number of frames in the container header, may differ from the number of decodable frames"""
+        return int(self._property(cv2.CAP_PROP_FRAME_COUNT))
+
+    def _open(self, start):
+        """capture positioned at frame start :
+        seek, and if the backend does not land on start, grab from the beginning
+        """
+        cap = cv2.VideoCapture(self.video_path)
+        if start > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != start:
+                cap.release()
+                cap = cv2.VideoCapture(self.video_path)
+                for _ in range(start):
+                    if not cap.grab():
+                        break
+        return cap
+
+    def _resize(self, frame):
+        if self.size is None or (frame.shape[1], frame.shape[0]) == self.size:
+            return frame
+        return cv2.resize(frame, self.size, interpolation=self.interpolation)
+
+    def indexed(self):
+        cap = self._open(self.start)
+        idx = self.start
+        self.num_frame = 0
+        try:
+            while cap.isOpened() and (self.end is None or idx < self.end):
+                if not cap.grab():
+                    break
+                self.num_frame += 1
+                if (idx - self.start) % self.step == 0:
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                    yield idx, self._resize(frame)
+                idx += 1
+        finally:
+            cap.release()
+
+    def __iter__(self):
+        for _, frame in self.indexed():
+            yield frame
+
+    def read(self, start, end):
+        """list of the frames [start, end) (every step-th of them)"""
+        reader = VideoReader(self.video_path, self.size, self.step, start, end, self.interpolation)
+        return list(reader)
+
+
+def benchmark_reader(video_path, end=1000, size=(128, 128), steps=(1, 2, 4)):
+    """frames/sec (walked frames) of full resolution decoding, decoding + resize, and step-th frame decoding"""
+    cases = [('full resolution', None, 1)] + [('{}x{} step {}'.format(size[0], size[1], step), size, step)
+                                              for step in steps]
+    for name, case_size, step in cases:
+        reader = VideoReader(video_path, size=case_size, step=step, end=end)
+        start_time = time.time()
+        for _ in reader:
+            pass
+        elapsed = time.time() - start_time
+        print('[INFO] {} : {:.1f} frames/sec'.format(name, reader.num_frame / max(elapsed, 1e-9)), flush=True)
+
+
+if __name__ == '__main__':
+    do_benchmark = False
+    if do_benchmark:
+        benchmark_reader('../misaeng_test/1001.0001.0001.0001.0008.mp4')
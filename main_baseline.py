@@ -3,7 +3,6 @@
 import os
 import json
 from torch import nn
-from torch.autograd import Variable
 from torch import optim
 from torch.optim import lr_scheduler
 
@@ -15,14 +14,21 @@ from data.test_data_loader import DataSet as test_DataSet
 import time
 import datetime
 
-from lib.utils import AverageMeter, calculate_accuracy, Configure, nms
+from lib.utils import AverageMeter, calculate_accuracy, Configure, nms_batched, nms_sweep
 from lib.pickle_utils import PickleUtils
+from lib.frame_store import FrameStore, FrameStoreWindows, to_pil_rgb
+from lib.clip_builder import ClipBuilder
+from lib.inference import InferenceEngine, get_amp_dtype, autocast, get_grad_scaler
+from lib.merge_policy import merge_transitions
+from lib.cascade import CandidateStage, fill_background
+from lib.video_prefetch import VideoPrefetcher
 from modules.teacher_student_module import TeacherStudentModule
 from modules.knowledge_distillation_loss import KDloss
+from modules.teacher_cache import IndexedDataset, TeacherLogitCache, build_teacher_cache
+from modules.teacher_pipeline import TeacherPipeline
 from modules.multiloss import MultiLoss
 from model_cls import build_model
 
-import cv2
 from tensorboardX import SummaryWriter
 import eval_res
 
@@ -44,213 +50,88 @@ def get_label(res_tensor):
 
 
 def get_labels_from_candidate(video, temporal_length, model, spatial_transform, batch_size, device, boundary_index, **args):
+    # video : FrameStore shared with candidate_extraction, or list of decoded frames
     print(boundary_index)
-    clip_batch = []
     labels = []
-    all_frames = []
-    info_boundary = []
 
-    print("[INFO] transform video for test")
-    video_length = 0
-    for i, im in enumerate(video):
-        frame = Image.fromarray(cv2.cvtColor(im, cv2.COLOR_BGR2RGB)).convert('RGB')
-        frame = spatial_transform(frame)
-        all_frames.append(frame)
-        video_length+=1
+    if not isinstance(video, FrameStore):
+        video = FrameStore.from_frames(video)
+    video_length = len(video)
+
+    boundary_index = np.asarray(boundary_index, dtype=np.float64)
+    start_frames = np.clip((boundary_index - (temporal_length / 2 - 1)).astype(np.int64), 0, None)
+    end_frames = np.clip((boundary_index + (temporal_length / 2) + 1).astype(np.int64), None, video_length)
+    start_frames = np.minimum(start_frames, end_frames - 1)
+    info_boundary = np.stack((start_frames, end_frames), 1)
+
+    # frames are transformed lazily, only when a candidate clip uses them,
+    # and stacked into one contiguous [num_used_frame, C, H, W] tensor
+    def transform(im):
+        return spatial_transform(to_pil_rgb(im))
+
+    used = np.zeros(video_length + 1, dtype=np.int64)
+    np.add.at(used, start_frames, 1)
+    np.add.at(used, np.minimum(start_frames + temporal_length, end_frames), -1)
+    frame_index = np.flatnonzero(np.cumsum(used[:-1]) > 0)
 
     print("[INFO] start video test")
-    for i, candidate_frame_number in enumerate(boundary_index):
-        start_frame = int(candidate_frame_number-(temporal_length/2-1))
-        start_frame = 0 if start_frame < 0 else start_frame
-        end_frame = int(candidate_frame_number+(temporal_length/2)+1)
-        end_frame = video_length if end_frame > video_length else end_frame
-
-        image_clip = all_frames[start_frame:end_frame]
-        info_boundary.append([start_frame, end_frame])
-        image_clip += [image_clip[-1] for _ in range(temporal_length - len(image_clip))]
-
-        if len(image_clip) == temporal_length:
-            clip = torch.stack(image_clip, 0).permute(1, 0, 2, 3)
-            clip_batch.append(clip)
-            # image_clip = image_clip[int(temporal_length / 2):]
-
-        if len(clip_batch) == batch_size or i==(len(boundary_index)-1):
-            clip_tensor = torch.stack(clip_batch, 0)
-            # Alexnet
-            # clip_tensor = Variable(clip_tensor)
-            # resnet
-            clip_tensor = Variable(clip_tensor).cuda(device)
-            results = model(clip_tensor)
+    if frame_index.shape[0] != 0:
+        video_tensor = torch.stack([video.get(j, transform, key=spatial_transform) for j in frame_index], 0)
+        clip_builder = ClipBuilder(video_tensor, temporal_length, batch_size, device, frame_index=frame_index)
+        for i in range(0, boundary_index.shape[0], batch_size):
+            clip_tensor = clip_builder.build(start_frames[i:i + batch_size], end_frames[i:i + batch_size])
+            with torch.no_grad():
+                results = model(clip_tensor)
             labels += get_label(results)
-            clip_batch = []
 
     print("[INFO] get predicted label")
-    res = [0]*video_length
-    for i, label in enumerate(labels):
-        range_of_frames = info_boundary[i]
-        for j in range(range_of_frames[0], range_of_frames[1]):
-            res[j] = label if label == 1 or res[j] == 0 else res[j]
-
-    final_res = []
-    i = 0
-    while i < len(res):
-        if res[i] > 0:
-            label = res[i]
-            begin = i
-            i += 1
-            while i < len(res) and res[i] == res[i - 1]:
-                i += 1
-            end = i - 1
-            final_res.append((begin, end, label))
-        else:
-            i += 1
+    labels = torch.cat(labels).view(-1).cpu().numpy() if len(labels) != 0 else np.zeros(0, dtype=np.int64)
+    res = np.zeros(video_length, dtype=np.int64)
+    # label 1 overwrites every other label, other labels are only written on background frames,
+    # so painted in reverse order, the first candidate wins
+    for i in np.flatnonzero(labels > 1)[::-1]:
+        res[start_frames[i]:end_frames[i]] = labels[i]
+    gradual = np.flatnonzero(labels == 1)
+    if gradual.shape[0] != 0:
+        coverage = np.zeros(video_length + 1, dtype=np.int64)
+        np.add.at(coverage, start_frames[gradual], 1)
+        np.add.at(coverage, end_frames[gradual], -1)
+        res[np.cumsum(coverage[:-1]) > 0] = 1
+
+    # runs of the same label : (begin, end, label), end inclusive
+    run_begin = np.concatenate(([0], np.flatnonzero(np.diff(res)) + 1))
+    run_end = np.concatenate((run_begin[1:], [video_length])) - 1
+    final_res = [(int(begin), int(end), int(res[begin]))
+                 for begin, end in zip(run_begin, run_end) if video_length != 0 and res[begin] > 0]
     return final_res
 
 
 def get_result(frame_pos, labels, opt):
     # print(labels)
     # print(frame_pos, flush=True)
-    do_origin = False
-
-    cut_priority = False
-    gradual_priority = False
-    train_type = opt.train_data_type
-    final_res = list()
-    if not do_origin:
-        for i, label in enumerate(labels):
-            # cut, gradual only
-            if label > 0:
-                if opt.loss_type != 'multiloss':
-                    start = int(frame_pos[i])
-                    # transition 데이터가 없을 때
-                    if len(final_res) == 0:
-                        final_res.append((start, start + opt.sample_duration, label))
-                    else:
-                        last_start = final_res[-1][0]
-                        last_end = final_res[-1][1]
-                        last_label = final_res[-1][2]
-                        # 범위가 겹치지 않을때
-                        if last_end < start:
-                            final_res.append((start, start + opt.sample_duration, label))
-                        # 범위가 겹칠 때
-                        else:
-                            # cut이 gradual보다 우선하는 정책
-                            if cut_priority:
-                                # 레이블이 같을 때
-                                if last_label == label:
-                                    final_res[-1] = (last_start, start + opt.sample_duration, label)
-                                # 나중에 나온 레이블이 cut
-                                elif last_label < label:
-                                    final_res[-1] = (last_start, start, last_label)
-                                    final_res.append((start, start + opt.sample_duration, label))
-                                # 나중에 나온 레이블이 gradual
-                                else:
-                                    final_res.append((last_end, start + opt.sample_duration, label))
-                            # gradual이 cut보다 우선하는 정책
-                            elif gradual_priority:
-                                # 레이블이 같을 때
-                                if last_label == label:
-                                    final_res[-1] = (last_start, start + opt.sample_duration, label)
-                                # 나중에 나온 레이블이 gradual
-                                elif last_label > label:
-                                    final_res[-1] = (last_start, start, last_label)
-                                    final_res.append((start, start + opt.sample_duration, label))
-                                # 나중에 나온 레이블이 cut
-                                else:
-                                    final_res.append((last_end, start + opt.sample_duration, label))
-                            # 나중에 오는 transition이 우선하는 정책
-                            else:
-                                if last_label == label:
-                                    final_res[-1] = (last_start, start + opt.sample_duration, label)
-                                else:
-                                    final_res[-1] = (last_start, start, last_label)
-                                    final_res.append((start, start + opt.sample_duration, label))
-                else:
-                    start, end = int(frame_pos[i][0]), int(frame_pos[i][1])
-                    if start < end:
-                        if len(final_res) == 0:
-                            final_res.append((start, end, label))
-                        else:
-                            last_start = final_res[-1][0]
-                            last_end = final_res[-1][1]
-                            last_label = final_res[-1][2]
-                            if label == 2 or (label == 1 and train_type == 'cut'):
-                                final_res.append((start, end, label))
-                                # # 안 겹칠 때
-                                # if last_end < start or end < last_start:
-                                #     if last_end < start:
-                                #         final_res.append((start, end, label))
-                                #     else:
-                                #         final_res.insert(-1, (start, end, label))
-                                # # 겹칠 때
-                                # else:
-                                #     # last_label=2, label=2
-                                #     if last_label == label:
-                                #         if last_start <= start <= last_end < end:
-                                #             final_res[-1] = (last_start, end, label)
-                                #         elif start <= last_start <= end < last_end:
-                                #             final_res[-1] = (start, last_end, label)
-                                #         elif start <= last_start < last_end <= end:
-                                #             final_res[-1] = (start, end, label)
-                                #         else:
-                                #             final_res[-1] = (last_start, last_end, label)
-                            else:
-                                if last_label == label:
-                                    # last_label=1, label=1
-                                    if (start - last_end) <= 8:
-                                        final_res[-1] = (last_start, end, label)
-                                    else:
-                                        final_res.append((start, end, label))
-                                else:
-                                    # 안 겹칠 경우
-                                    if last_end < start or end < last_start:
-                                        if last_end < start:
-                                            final_res.append((start, end, label))
-                                        else:
-                                            final_res.insert(-1, (start, end, label))
-                                    # 겹칠 경우
-                                    else:
-                                        if last_start <= start <= last_end < end:
-                                            final_res[-1] = (last_start, start - 1, last_label)
-                                            final_res.append((start, end, label))
-                                        elif start <= last_start <= end < last_end:
-                                            final_res[-1] = (start, end, label)
-                                            final_res.append((end + 1, last_end, last_label))
-                                        elif start <= last_start < last_end <= end:
-                                            final_res[-1] = (start, end, label)
-                                        else:
-                                            final_res[-1] = (last_start, last_end, last_label)
-    else:
-        i = 0
-        while i < len(labels):
-            if labels[i] > 0:
-                label = labels[i]
-                begin = i
-                i += 1
-                while i < len(labels) and labels[i] == labels[i - 1]:
-                    i += 1
-                end = i - 1
-                begin_frame = int(begin * opt.sample_duration / 2 + 1)
-                end_frame = int(end * opt.sample_duration / 2 + 16 + 1)
-                final_res.append((begin_frame, end_frame, label))
-            else:
-                i += 1
-    return final_res
+    # merge policy : latest | cut | gradual | origin, multiloss detector bars are merged by the multiloss policy
+    policy = opt.merge_policy
+    if opt.loss_type == 'multiloss' and policy != 'origin':
+        policy = 'multiloss'
+    return merge_transitions(frame_pos, labels, opt.sample_duration, policy=policy,
+                             train_data_type=opt.train_data_type)
 
 
 def get_frames_labels(prediction_list, opt):
     if opt.loss_type == 'multiloss':
-        all_result = torch.zeros(prediction_list.size(0), 4).to(opt.device)
-        start_count = 0
+        all_result = torch.zeros(0, 4).to(opt.device)
         end_count = 0
         if prediction_list.size(0) != 0:
-            for cls in range(1, opt.n_classes):
-                cls_idx = prediction_list[:, -1] == cls
-                nms_list = prediction_list[cls_idx]
-                ids, count = nms(nms_list[:, :2], nms_list[:, -2], overlap=opt.nms_threshold)
-                end_count += count
-                all_result[start_count:end_count] = nms_list[ids[:count]]
-                start_count += count
+            cls_idx = (prediction_list[:, -1] >= 1) & (prediction_list[:, -1] < opt.n_classes)
+            nms_list = prediction_list[cls_idx]
+            if opt.nms_mode == 'sweep':
+                ids = nms_sweep(nms_list[:, :2], nms_list[:, -2], nms_list[:, -1],
+                                overlap=opt.nms_threshold, check_policy=opt.nms_policy)
+            else:
+                ids = nms_batched(nms_list[:, :2], nms_list[:, -2], nms_list[:, -1],
+                                  overlap=opt.nms_threshold, check_policy=opt.nms_policy)
+            end_count = ids.size(0)
+            all_result = nms_list[ids.to(nms_list.device)]
 
         print(all_result[:end_count])
         _, idx_sort = all_result[:end_count, 0].sort(0)
@@ -265,8 +146,20 @@ def get_frames_labels(prediction_list, opt):
 def test(video_path, test_data_loader, model, opt):
     # frame_pos = list()
     # labels = list()
-    prediction_list = torch.Tensor()
+    # predictions of each batch are copied to host asynchronously and concatenated once at the end
+    prediction_chunks = list()
+    use_pinned = torch.device(opt.device).type == 'cuda'
+
+    def append_prediction(prediction):
+        if use_pinned:
+            host = torch.empty(prediction.size(), dtype=prediction.dtype, pin_memory=True)
+            host.copy_(prediction, non_blocking=True)
+            prediction_chunks.append(host)
+        else:
+            prediction_chunks.append(prediction)
 
+    engine = InferenceEngine(model, opt.device, amp=opt.amp)
+    engine.start_video()
     batch_time = time.time()
     total_iter = len(test_data_loader)
     for i, (clip, boundary) in enumerate(test_data_loader):
@@ -288,19 +181,19 @@ def test(video_path, test_data_loader, model, opt):
         # multiloss 일 때, 처리하는 부분 추가
         if opt.loss_type == 'multiloss':
             # frame_info, label = model(clip, boundary)
-            prediction = model(clip, boundary)
+            prediction = engine(clip, boundary)
 
             # frame_pos += [[start.item(), end.item()] for start, end in frame_info]
             # labels += [cls.item() for cls in label]
             # frame_pos += [frame_info.view(-1, 2)]
             # labels += [label.view(-1, 1)]
-            prediction_list = torch.cat((prediction_list, prediction), 0)
+            append_prediction(prediction)
         else:
-            results = model(clip)
+            results = engine(clip)
             # frame_pos += [frame.item() for frame in boundary]
             # labels += get_label(results)
             prediction = torch.cat((boundary.view(-1, 1), get_label(results).view(-1, 1)), 1)
-            prediction_list = torch.cat((prediction_list, prediction), 0)
+            append_prediction(prediction)
 
         if (i+1) % 10 == 0 or i+1 == total_iter:
             end_time = time.time() - batch_time
@@ -325,6 +218,13 @@ def test(video_path, test_data_loader, model, opt):
     #     new_result = all_result[idx_sort]
     #     frame_pos, labels = new_result[:, :2], new_result[:, -1]
 
+    if use_pinned:
+        torch.cuda.synchronize()
+    engine.end_video(os.path.basename(video_path))
+    if len(prediction_chunks) == 0:
+        return torch.Tensor()
+    prediction_list = torch.cat(prediction_chunks, 0)
+
     # return [frame_pos, labels]
     return prediction_list
 
@@ -479,10 +379,27 @@ def test_dataset(opt, model):
         video_name_list = [line.strip('\n') for line in f.readlines()]
 
     # data_name_list = ['frame_pos', 'labels']
-    data_name_list = ['predictions']
+    # cascade : the detector only classifies windows around candidate boundaries, kept apart from full predictions
+    data_name_list = ['predictions.cascade'] if opt.cascade else ['predictions']
     pickle_utils = PickleUtils(opt, video_name_list, data_name_list)
+    candidate_stage = CandidateStage(opt) if opt.cascade else None
+    if opt.frame_store:
+        assert opt.cascade and opt.input_type == 'RGB', 'frame_store : cascade test of RGB input only'
 
     gts = json.load(open(opt.gt_dir, 'r'))
+    dataset_kwargs = dict(spatial_transform=spatial_transform,
+                          temporal_transform=temporal_transform,
+                          target_transform=target_transform,
+                          sample_duration=opt.sample_duration,
+                          input_type=opt.input_type, candidate=opt.candidate)
+
+    # videos which are not tested yet are decoded and preprocessed in worker processes,
+    # opt.prefetch_videos videos ahead of the one in inference (the cascade picks windows per video, so not with it)
+    prefetcher = None
+    if opt.prefetch_videos > 0 and candidate_stage is None:
+        video_args = [((root_dir, video_name, gts[video_name]['frame_num']), dataset_kwargs)
+                      for video_name in video_name_list if pickle_utils.check_pickle_data(video_name)]
+        prefetcher = iter(VideoPrefetcher(test_DataSet, video_args, opt.batch_size, opt.prefetch_videos))
 
     res = {}
     # print('\n====> Testing Start', flush=True)
@@ -491,18 +408,36 @@ def test_dataset(opt, model):
         video_time = time.time()
         print("Process {} : {}\n"
               "Path : {}".format(idx + 1, video_name, os.path.join(root_dir, video_name)), flush=True)
-        test_data = test_DataSet(root_dir, video_name, gts[video_name]['frame_num'],
-                                 spatial_transform=spatial_transform,
-                                 temporal_transform=temporal_transform,
-                                 target_transform=target_transform,
-                                 sample_duration=opt.sample_duration,
-                                 input_type=opt.input_type, candidate=opt.candidate)
-        test_data_loader = torch.utils.data.DataLoader(test_data, batch_size=opt.batch_size,
-                                                       num_workers=opt.n_threads, pin_memory=True)
+        if prefetcher is None:
+            test_data = test_DataSet(root_dir, video_name, gts[video_name]['frame_num'], **dataset_kwargs)
+            test_data_loader = torch.utils.data.DataLoader(test_data, batch_size=opt.batch_size,
+                                                           num_workers=opt.n_threads, pin_memory=True)
         if pickle_utils.check_pickle_data(video_name):
             video_path = os.path.join(root_dir, video_name)
+            if prefetcher is not None:
+                test_data_loader = next(prefetcher)
+            frame_store = None
+            if candidate_stage is not None:
+                # both stages read the frames decoded once into the store
+                if opt.frame_store:
+                    frame_store = FrameStore(video_path, gts[video_name]['frame_num'],
+                                             store_dir=opt.frame_store_dir if opt.frame_store_dir else None)
+                window_index = candidate_stage.windows(root_dir, video_name, gts[video_name]['frame_num'],
+                                                       len(test_data), frame_store=frame_store)
+                print('[INFO] cascade : {}/{} windows'.format(window_index.shape[0], len(test_data)), flush=True)
+                if frame_store is not None:
+                    window_data = FrameStoreWindows(frame_store, window_index * (opt.sample_duration // 2),
+                                                    opt.sample_duration, spatial_transform)
+                else:
+                    window_data = torch.utils.data.Subset(test_data, window_index.tolist())
+                test_data_loader = torch.utils.data.DataLoader(window_data, batch_size=opt.batch_size,
+                                                               num_workers=opt.n_threads, pin_memory=True)
             # frame_pos, labels = test(video_path, test_data_loader, model, device, opt)
             predictions = [test(video_path, test_data_loader, model, opt)]
+            if frame_store is not None:
+                frame_store.close()
+            if candidate_stage is not None and opt.loss_type != 'multiloss':
+                predictions = [fill_background(predictions[0], window_index, len(test_data), opt.sample_duration)]
             pickle_utils.save_pickle(video_name, predictions)
         else:
             # frame_pos, labels = load_pickle(frame_pos_path, labels_path)
@@ -547,13 +482,15 @@ def test_dataset(opt, model):
 
 # 19.3.8 revision
 # add parameter : "device"
-def train(cur_iter, iter_per_epoch, epoch, data_loader, model, criterion, optimizer, scheduler, opt):
+def train(cur_iter, iter_per_epoch, epoch, data_loader, model, criterion, optimizer, scheduler, opt,
+          teacher_cache=None):
     # 19.3.14. add
     # print("device : ", torch.cuda.get_device_name(0), flush=True)
     # torch.set_default_tensor_type('torch.cuda.DoubleTensor')
     # 19.5.10. revision
-    for i in range(opt.gpu_num):
-        print("device {} : {}".format(i, torch.cuda.get_device_name(i)), flush=True)
+    if torch.cuda.is_available():
+        for i in range(opt.gpu_num):
+            print("device {} : {}".format(i, torch.cuda.get_device_name(i)), flush=True)
 
     # batch_time = AverageMeter()
     data_time = AverageMeter()
@@ -583,19 +520,57 @@ def train(cur_iter, iter_per_epoch, epoch, data_loader, model, criterion, optimi
 
     writer = SummaryWriter('runs/')
     c = Configure(sample_duration=opt.sample_duration, data_type=opt.train_data_type)
+
+    # mixed precision (bfloat16 on cpu, float16 + GradScaler on cuda)
+    # and gradient accumulation : optimizer steps every accumulation_steps iterations,
+    # effective batch size = batch_size * accumulation_steps
+    amp_dtype = get_amp_dtype(opt.device, opt.amp)
+    scaler = get_grad_scaler(opt.device, amp_dtype)
+    accumulation_steps = max(opt.accumulation_steps, 1)
+    step_loss = 0.
+    clip_num = 0
+    optimizer.zero_grad()
+    print('effective batch size : {} (accumulation_steps : {}), amp : {}'.format(
+        opt.batch_size * accumulation_steps, accumulation_steps, amp_dtype), flush=True)
+
+    # without teacher cache, the teacher can run one batch ahead in a worker thread
+    teacher_pipeline = None
+    if opt.loss_type == 'KDloss' and teacher_cache is None and opt.teacher_pipeline:
+        teacher_pipeline = TeacherPipeline(data_loader, model.teacher_model, opt.device,
+                                           depth=opt.teacher_pipeline_depth)
+
     print('\n====> Training Start', flush=True)
     while i < total_iter:
         start_time = time.time()
-        for _, (inputs, targets) in enumerate(data_loader):
+        if teacher_pipeline is not None:
+            batches = teacher_pipeline
+        else:
+            batches = ((batch, None) for batch in data_loader)
+        for _, (batch, teacher_logits) in enumerate(batches):
             # for check size
             # print(sys.getsizeof(inputs))
+            inputs, targets = batch[0], batch[1]
+
+            # teacher logits from the teacher cache : batch = (inputs, targets, sample index, augmentation seed)
+            if teacher_cache is not None:
+                teacher_logits = teacher_cache.get(batch[2].numpy(), batch[3].numpy())
+                if teacher_logits is None:
+                    assert opt.teacher_cache_fallback, \
+                        'batch is not in the teacher cache {}'.format(opt.teacher_cache_dir)
+                else:
+                    teacher_logits = teacher_logits.to(opt.device, non_blocking=True)
 
             inputs = inputs.to(opt.device, non_blocking=True)
             with torch.no_grad():
                 targets = targets.to(opt.device, non_blocking=True)
-            outputs = model(inputs)
+            with autocast(opt.device, amp_dtype):
+                if teacher_logits is None:
+                    outputs = model(inputs)
+                else:
+                    outputs = model(inputs, teacher_logits)
 
-            loss = criterion(outputs, targets)
+                loss = criterion(outputs, targets)
+            clip_num += inputs.size(0)
 
             if opt.loss_type in ['KDloss']:
                 outputs = outputs[1]
@@ -605,23 +580,37 @@ def train(cur_iter, iter_per_epoch, epoch, data_loader, model, criterion, optimi
                 avg_acc[key] += acc[key] / 10
                 epoch_acc[key] += acc[key] / iter_per_epoch
 
-            optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()
-            scheduler.step(loss.item())
+            step_loss += loss.detach().float() / accumulation_steps
+            if scaler is not None:
+                scaler.scale(loss / accumulation_steps).backward()
+            else:
+                (loss / accumulation_steps).backward()
 
             i += 1
 
+            if i % accumulation_steps == 0 or i >= total_iter:
+                if scaler is not None:
+                    scaler.step(optimizer)
+                    scaler.update()
+                else:
+                    optimizer.step()
+                optimizer.zero_grad()
+                scheduler.step(step_loss.item())
+                step_loss = 0.
+
             # logging iteration #, loss, lr, batch_time
             # and draw log to tensorboard
             # per 10 iterations
             if i % 10 == 0:
                 batch_time = time.time() - start_time
+                clips_per_sec = clip_num / batch_time
+                clip_num = 0
                 lr = optimizer.param_groups[0]['lr']
-                print('Iter:{} Loss(per 10 batch):{} lr:{} batch_time:{:.3f}s'.format(
-                    i, loss.item(), lr, batch_time), flush=True)
+                print('Iter:{} Loss(per 10 batch):{} lr:{} batch_time:{:.3f}s {:.2f}clips/sec'.format(
+                    i, loss.item(), lr, batch_time, clips_per_sec), flush=True)
 
                 writer.add_scalar('learning_rate', lr, i)
+                writer.add_scalar('throughput/clips_per_sec', clips_per_sec, i)
                 writer.add_scalar('acc_loss/loss', loss.item(), i)
                 writer.add_scalar('loss/loss', loss.item(), i)
 
@@ -791,6 +780,18 @@ def train_dataset(opt, model):
         weights = torch.DoubleTensor(training_data.weights)
         sampler = torch.utils.data.sampler.WeightedRandomSampler(weights, len(weights))
 
+        # teacher logits computed once for every (sample, augmentation seed) and read from disk while training
+        teacher_cache = None
+        if opt.loss_type == 'KDloss' and opt.teacher_cache_dir:
+            if opt.teacher_cache_seeds == 1:
+                print('[WARNING] teacher_cache_seeds 1 : every training sample keeps one fixed augmentation '
+                      'for the whole run', flush=True)
+            training_data = IndexedDataset(training_data, num_seeds=opt.teacher_cache_seeds)
+            teacher_cache = TeacherLogitCache(opt.teacher_cache_dir, len(training_data), opt.teacher_cache_seeds,
+                                              opt.n_classes, teacher_path=opt.teacher_model_path)
+            build_teacher_cache(model.teacher_model, training_data, teacher_cache, opt.device,
+                                batch_size=opt.batch_size, num_workers=opt.n_threads)
+
         training_data_loader = torch.utils.data.DataLoader(training_data, batch_size=opt.batch_size,
                                                            num_workers=opt.n_threads, sampler=sampler, pin_memory=True)
 
@@ -798,7 +799,8 @@ def train_dataset(opt, model):
 
         # 19.3.8. add
         # train(cur_iter,opt.total_iter,training_data_loader, model, criterion, optimizer,scheduler,opt)
-        train(cur_iter, opt.iter_per_epoch, opt.epoch, training_data_loader, model, criterion, optimizer, scheduler, opt)
+        train(cur_iter, opt.iter_per_epoch, opt.epoch, training_data_loader, model, criterion, optimizer, scheduler,
+              opt, teacher_cache=teacher_cache)
 
 
 def build_final_model(opt):
@@ -358,20 +358,23 @@ class ResNeXt(nn.Module):
 
         return nn.Sequential(*layers)
 
-    def forward(self, x, boundaries=None):
-        # x = x.to(device)
-        # x = x.cuda()
-        # if self.sample_size == 128:
-        #     x = self.avgpool_128(x)
+    def forward_stem(self, x, num_stages=1):
+        """conv1 ~ layer[num_stages].
+        with sliding-window inference it runs once on the frames shared by overlapping windows
+        """
         x = self.conv1(x)
         x = self.bn1(x)
         x = self.relu(x)
         x = self.maxpool(x)
 
-        x = self.layer1(x)
-        x = self.layer2(x)
-        x = self.layer3(x)
-        x = self.layer4(x)
+        for layer in [self.layer1, self.layer2, self.layer3, self.layer4][:num_stages]:
+            x = layer(x)
+        return x
+
+    def forward_head(self, x, boundaries=None, num_stages=1):
+        """layer[num_stages + 1] ~ detector / fc on the output of forward_stem"""
+        for layer in [self.layer1, self.layer2, self.layer3, self.layer4][num_stages:]:
+            x = layer(x)
 
         if self.Detector_layer is not None:
             out = self.Detector_layer(x, boundaries)
@@ -383,6 +386,13 @@ class ResNeXt(nn.Module):
 
         return out
 
+    def forward(self, x, boundaries=None):
+        # x = x.to(device)
+        # x = x.cuda()
+        # if self.sample_size == 128:
+        #     x = self.avgpool_128(x)
+        return self.forward_head(self.forward_stem(x), boundaries)
+
     def load_weights(self, base_file):
         other, ext = os.path.splitext(base_file)
         if ext == '.pkl' or '.pth':
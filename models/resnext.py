@@ -120,18 +120,23 @@ class ResNeXt(nn.Module):
 
         return nn.Sequential(*layers)
 
-    def forward(self, x):
-        # x = x.to(device)
-        # x = x.cuda()
+    def forward_stem(self, x, num_stages=1):
+        """conv1 ~ layer[num_stages].
+        with sliding-window inference it runs once on the frames shared by overlapping windows
+        """
         x = self.conv1(x)
         x = self.bn1(x)
         x = self.relu(x)
         x = self.maxpool(x)
 
-        x = self.layer1(x)
-        x = self.layer2(x)
-        x = self.layer3(x)
-        x = self.layer4(x)
+        for layer in [self.layer1, self.layer2, self.layer3, self.layer4][:num_stages]:
+            x = layer(x)
+        return x
+
+    def forward_head(self, x, num_stages=1):
+        """layer[num_stages + 1] ~ fc on the output of forward_stem"""
+        for layer in [self.layer1, self.layer2, self.layer3, self.layer4][num_stages:]:
+            x = layer(x)
 
         x = self.avgpool(x)
 
@@ -140,6 +145,11 @@ class ResNeXt(nn.Module):
 
         return x
 
+    def forward(self, x):
+        # x = x.to(device)
+        # x = x.cuda()
+        return self.forward_head(self.forward_stem(x))
+
     def load_weights(self, base_file):
         other, ext = os.path.splitext(base_file)
         if ext == '.pkl' or '.pth':
@@ -1,3 +1,3 @@
-__all__ = ['knowledge_distillation_loss', 'teacher_student_module', 'multiloss']
+__all__ = ['knowledge_distillation_loss', 'teacher_student_module', 'multiloss', 'teacher_cache', 'teacher_pipeline']
 
 from .layers import *
@@ -1,6 +1,6 @@
 import torch
 import torch.nn as nn
-from lib.utils import Configure, decoding, detection
+from lib.utils import Configure, decoding, detection_batched
 
 
 class MultiDetector(nn.Module):
@@ -137,7 +137,7 @@ class MultiDetector(nn.Module):
                 total_length = self.sample_duration
 
                 loc, conf = out
-                loc = decoding(loc, total_length)
+                loc = decoding(loc.float(), total_length)
 
                 frame_pos = torch.zeros(loc.size(0), loc.size(1))
                 for i in range(batch_size):
@@ -211,9 +211,10 @@ class MultiDetector(nn.Module):
             # cut : loc[8, 15, 2], conf[8, 15, num_classes]
             # gradual : loc[8, 11, 2], conf[8, 11, num_classes]
             if self.phase == 'test':
-                out = (out[1], self.softmax(out[1]))
-                output, pred_num = detection(out, self.sample_duration, self.num_classes, self.default_bar,
-                                             self.conf_thresh, boundaries=start_boundaries)
+                # post-processing in float32, also when the forward runs under autocast
+                out = (out[1].float(), self.softmax(out[1].float()))
+                output, pred_num = detection_batched(out, self.sample_duration, self.num_classes, self.default_bar,
+                                                     self.conf_thresh, boundaries=start_boundaries)
 
                 # # output = [batch_size, num_classes, num_bars, [start, end, conf]]
                 # pred_num = torch.zeros(batch_size, self.num_classes, dtype=torch.int32)
@@ -233,27 +234,16 @@ class MultiDetector(nn.Module):
                 #                 break
                 #         pred_num[batch_num, cls] = i
 
-                total_bars_num = pred_num.int().sum().clone().detach().data
-                prediction = torch.zeros(total_bars_num, 4).to(self.device)
-                # frame_pos = torch.zeros(total_bars_num, 2).to(device)
-                # labels = torch.zeros(total_bars_num, 1).to(device)
-                num = 0
-                for batch_num in range(batch_size):
-                    for cls in range(1, self.num_classes):
-                        result_num = pred_num[batch_num, cls].item()
-                        for i in range(result_num):
-                            bound_start = output[batch_num, cls, i, 0]
-                            bound_end = output[batch_num, cls, i, 1]
-                            if bound_start == 0 and bound_end == 0:
-                                pass
-                            else:
-                                prediction[num, :-1] = output[batch_num, cls, i, :].clone().detach()
-                                prediction[num, -1] = cls
-                                num += 1
-                # frame_pos = [bars_num, 2]
-                # labels = [bars_num, 1]
-                # out = (frame_pos[:num], labels[:num])
-                out = prediction[:num]
+                # prediction = [bars_num, 4] : start, end, conf, class
+                # bars in order of batch, class(background excluded), conf ; bars zeroed by the range check are dropped
+                num_bars = output.size(2)
+                keep = torch.arange(num_bars, device=output.device).view(1, 1, -1) < pred_num.unsqueeze(-1).long()
+                keep[:, 0] = False
+                keep &= (output[:, :, :, 0] != 0) | (output[:, :, :, 1] != 0)
+                cls = torch.arange(self.num_classes, device=output.device).float().view(1, -1, 1, 1)
+                cls = cls.expand(batch_size, self.num_classes, num_bars, 1)
+                prediction = torch.cat((output, cls), -1)[keep]
+                out = prediction.to(self.device)
 
         return out
 
@@ -1,7 +1,7 @@
 import torch
 import torch.nn as nn
 from modules.layers.multi_detector import MultiDetector
-from lib.utils import encoding, cal_iou, log_sum_exp, Configure
+from lib.utils import encoding, log_sum_exp, Configure, match_default_bars
 
 
 class MultiLoss(nn.Module):
@@ -16,11 +16,47 @@ class MultiLoss(nn.Module):
         self.negpos_ratio = neg_ratio
         self.neg_threshold = neg_threshold
 
-        self.reg_loss = nn.SmoothL1Loss()
-        # self.reg_loss = nn.MSELoss()
-        self.conf_loss = nn.CrossEntropyLoss()
+        if not self.extra_layers:
+            self.reg_loss = nn.SmoothL1Loss()
+            # self.reg_loss = nn.MSELoss()
+            self.conf_loss = nn.CrossEntropyLoss()
+        else:
+            self.reg_loss = nn.SmoothL1Loss(reduction='sum')
+            self.conf_loss = nn.CrossEntropyLoss(reduction='sum')
         c = Configure(sample_duration=sample_duration, data_type=data_type, policy=policy)
-        self.default_bar = c.get_default_bar()
+        # default bars and the match table of integer ground truths follow the module to the device with .to(device)
+        self.register_buffer('default_bar', c.get_default_bar().float())
+        self.bar_table = c.get_bar_table()
+
+    def match(self, targets):
+        """targets : [batch_size, 3] (start, end, label), one ground truth per clip
+        return loc_t : [batch_size, default_bar_num, 2] encoded offsets, conf_t : [batch_size, default_bar_num] labels
+        (0 : negative, 1 : background, label + 1 : transition), for the whole batch at once
+        """
+        truths = targets[:, :-1].detach().float()          # [batch_size, 2]
+        labels = targets[:, -1].detach().to(torch.long)    # [batch_size]
+
+        # integer ground truths inside the clip : gather from the table, else computed
+        matched = self.bar_table.lookup(truths)
+        if matched is None:
+            matched = match_default_bars(truths, self.default_bar.to(truths.device))
+        _, _, best_truth_overlap, loc_t = matched
+        best_truth_overlap = best_truth_overlap.to(targets.device)
+        loc_t = loc_t.to(targets.device)
+        conf = (labels + 1).view(-1, 1).expand_as(best_truth_overlap).clone()
+
+        background_conf_idx = conf == 1         # get index of background
+        if isinstance(self.neg_threshold, tuple):
+            neg_thresh_cut = self.neg_threshold[0]
+            neg_thresh_gradual = self.neg_threshold[1]
+            cut_idx = (conf == 2) & (best_truth_overlap < neg_thresh_cut)
+            gradual_idx = (conf == 3) & (best_truth_overlap < neg_thresh_gradual)
+            conf[cut_idx | gradual_idx] = 0
+        else:
+            conf[best_truth_overlap < self.neg_threshold] = 0     # label as negative
+        conf[background_conf_idx] = 1           # set label to background
+
+        return loc_t, conf
 
     def forward(self, predictions, targets):
         total_length = self.sample_duration
@@ -39,67 +75,8 @@ class MultiLoss(nn.Module):
             # loc_pred : [batch_size, default_bar_num, 2]
             # conf_pred : [batch_size, default_bar_num, 3]
             batch_size = targets.size(0)
-            default_bar_num = self.default_bar.size(0)
-            self.reg_loss = nn.SmoothL1Loss(reduction='sum')
-            self.conf_loss = nn.CrossEntropyLoss(reduction='sum')
-
-            loc_t = torch.Tensor(batch_size, default_bar_num, 2)
-            conf_t = torch.LongTensor(batch_size, default_bar_num)
-            # wrap targets
             with torch.no_grad():
-                self.default_bar = self.default_bar.to(self.device)
-                loc_t = loc_t.to(self.device)
-                conf_t = conf_t.to(self.device)
-
-            for idx in range(batch_size):
-                truths = targets[idx, :-1].view(-1, 2).data                # [1, 2]
-                labels = targets[idx, -1].view(-1, 1).to(torch.long).data  # [1, 1]
-                default = self.default_bar.clone().detach().data           # [default_bar_num, 2]
-                # jaccard index
-                # truths = truths.view(-1, 1, 2)      # [1, 1, 2]
-                # labels = labels.view(-1, 1)         # [1, 1]
-                # default = default.view(1, -1, 2)    # [1, default_bar_num, 2]
-                overlaps = cal_iou(                 # [1, default_bar_num]
-                    truths,
-                    default,
-                    use_default=True
-                )
-                # (Bipartite Matching)
-                # [1(gt_num), 1] best prior for each ground truth
-                best_prior_overlap, best_prior_idx = overlaps.max(1, keepdim=True)  # GT와 가장 많이 겹치는 default
-                # [1, default_bar_num] best ground truth for each prior
-                best_truth_overlap, best_truth_idx = overlaps.max(0, keepdim=True)  # default와 가장 많이 겹치는 GT
-                best_prior_idx.squeeze_(1)          # [1(gt_num)]
-                best_prior_overlap.squeeze_(1)      # [1(gt_num)]
-                best_truth_idx.squeeze_(0)          # [default_bar_num]
-                best_truth_overlap.squeeze_(0)      # [default_bar_num]
-                best_truth_overlap.index_fill_(0, best_prior_idx, 2)  # ensure best prior
-                # TODO refactor: index  best_prior_idx with long tensor
-                # ensure every gt matches with its prior of max overlap
-                for j in range(best_prior_idx.size(0)):
-                    best_truth_idx[best_prior_idx[j]] = j
-                matches = truths[best_truth_idx]    # Shape: [default_bar_num, 2]
-                conf = labels[best_truth_idx] + 1   # Shape: [default_bar_num]
-
-                background_conf_idx = conf == 1         # get index of background
-                if isinstance(self.neg_threshold, tuple):
-                    neg_thresh_cut = self.neg_threshold[0]
-                    neg_thresh_gradual = self.neg_threshold[1]
-                    cut_idx = conf == 2
-                    gradual_idx = conf == 3
-                    cut_idx[best_truth_overlap >= neg_thresh_cut] = 0
-                    gradual_idx[best_truth_overlap >= neg_thresh_gradual] = 0
-                    conf[cut_idx] = 0
-                    conf[gradual_idx] = 0
-                else:
-                    conf[best_truth_overlap < self.neg_threshold] = 0     # label as negative
-                conf[background_conf_idx] = 1           # set label to background
-
-                assert matches.size() == self.default_bar.size(),\
-                    "matches_size : {}, default_bar_size : {}".format(matches.size(), default.size())
-                loc = encoding(matches, total_length, default_bar=default)
-                loc_t[idx] = loc  # [default_bar_num,2] encoded offsets to learn
-                conf_t[idx] = conf.squeeze(1)  # [default_bar_num] top class label for each prior
+                loc_t, conf_t = self.match(targets)
 
             pos = conf_t > 0
             loc_pos = conf_t > 1
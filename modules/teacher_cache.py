@@ -0,0 +1,148 @@
+import os
+import json
+import random
+import contextlib
+import numpy as np
+import torch
+from lib.feature_cache import file_hash
+
+TEACHER_CACHE_VERSION = 1
+
+
+@contextlib.contextmanager
+def fixed_seed(seed):
+    """random, numpy and torch RNG seeded with seed inside the block, restored after it"""
+    py_state, np_state, torch_state = random.getstate(), np.random.get_state(), torch.get_rng_state()
+    random.seed(seed)
+    np.random.seed(seed % (1 << 32))
+    torch.manual_seed(seed)
+    try:
+        yield
+    finally:
+        random.setstate(py_state)
+        np.random.set_state(np_state)
+        torch.set_rng_state(torch_state)
+
+
+class IndexedDataset(torch.utils.data.Dataset):
+    """Training dataset whose samples are keyed by (sample index, augmentation seed).
+    Each sample draws one of num_seeds augmentation seeds and is made with all RNGs seeded by the key,
+    so the same key always gives the same clip (and the same teacher logits).
+    The student therefore only sees num_seeds augmentations of each sample during the whole training.
+    Returns (inputs, targets, index, seed).
+    """
+    def __init__(self, dataset, num_seeds=1):
+        self.dataset = dataset
+        self.num_seeds = num_seeds
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getattr__(self, name):
+        # weights etc. of the wrapped dataset
+        if name == 'dataset':
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def sample(self, index, seed):
+        with fixed_seed(index * self.num_seeds + seed):
+            return self.dataset[index]
+
+    def __getitem__(self, index):
+        seed = int(torch.randint(self.num_seeds, (1,)).item())
+        inputs, targets = self.sample(index, seed)
+        return inputs, targets, index, seed
+
+
+class _AllKeys(torch.utils.data.Dataset):
+    def __init__(self, indexed_dataset):
+        self.indexed_dataset = indexed_dataset
+
+    def __len__(self):
+        return len(self.indexed_dataset) * self.indexed_dataset.num_seeds
+
+    def __getitem__(self, key):
+        index, seed = divmod(key, self.indexed_dataset.num_seeds)
+        inputs, _ = self.indexed_dataset.sample(index, seed)
+        return inputs, index, seed
+
+
+class TeacherLogitCache:
+    """Teacher logits of the training set on disk, [num_samples, num_seeds, num_classes] float32
+    and a filled mask [num_samples, num_seeds], both memory-mapped.
+    The manifest holds the teacher weight hash, so a cache of another teacher is not used.
+    """
+    def __init__(self, cache_dir, num_samples, num_seeds, num_classes, teacher_path=''):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.manifest = {
+            'version': TEACHER_CACHE_VERSION,
+            'num_samples': num_samples,
+            'num_seeds': num_seeds,
+            'num_classes': num_classes,
+            'teacher_hash': file_hash(teacher_path) if os.path.isfile(teacher_path) else teacher_path,
+        }
+        logits_path = os.path.join(cache_dir, 'logits.npy')
+        filled_path = os.path.join(cache_dir, 'filled.npy')
+        manifest_path = os.path.join(cache_dir, 'manifest.json')
+
+        valid = False
+        if os.path.isfile(manifest_path) and os.path.isfile(logits_path) and os.path.isfile(filled_path):
+            with open(manifest_path, 'r') as f:
+                valid = json.load(f) == self.manifest
+            if not valid:
+                print('[INFO] stale teacher cache : {}'.format(cache_dir), flush=True)
+
+        if valid:
+            self.logits = np.load(logits_path, mmap_mode='r+')
+            self.filled = np.load(filled_path, mmap_mode='r+')
+        else:
+            self.logits = np.lib.format.open_memmap(logits_path, mode='w+', dtype=np.float32,
+                                                    shape=(num_samples, num_seeds, num_classes))
+            self.filled = np.lib.format.open_memmap(filled_path, mode='w+', dtype=np.bool_,
+                                                    shape=(num_samples, num_seeds))
+            self.filled[:] = False
+            self.flush()
+            with open(manifest_path, 'w') as f:
+                json.dump(self.manifest, f, indent=2)
+
+    def is_complete(self):
+        return bool(self.filled.all())
+
+    def put(self, indices, seeds, logits):
+        indices, seeds = np.asarray(indices), np.asarray(seeds)
+        self.logits[indices, seeds] = logits.detach().float().cpu().numpy()
+        self.filled[indices, seeds] = True
+
+    def get(self, indices, seeds):
+        """[batch_size, num_classes] tensor, or None if one of the keys is not cached"""
+        indices, seeds = np.asarray(indices), np.asarray(seeds)
+        if not self.filled[indices, seeds].all():
+            return None
+        return torch.from_numpy(np.array(self.logits[indices, seeds]))
+
+    def flush(self):
+        self.logits.flush()
+        self.filled.flush()
+
+
+def build_teacher_cache(teacher_model, indexed_dataset, cache, device, batch_size=32, num_workers=0):
+    """Run the frozen teacher (eval mode) once over every (sample, seed) of the training set
+    which is not cached yet
+    """
+    keys = np.flatnonzero(~np.asarray(cache.filled).reshape(-1))
+    if keys.shape[0] == 0:
+        return
+    loader = torch.utils.data.DataLoader(torch.utils.data.Subset(_AllKeys(indexed_dataset), keys.tolist()),
+                                         batch_size=batch_size, num_workers=num_workers, shuffle=False)
+    was_training = teacher_model.training
+    teacher_model.eval()
+    print('[INFO] teacher cache : {} clips to compute'.format(keys.shape[0]), flush=True)
+    with torch.no_grad():
+        for i, (inputs, indices, seeds) in enumerate(loader):
+            cache.put(indices.numpy(), seeds.numpy(), teacher_model(inputs.to(device)))
+            if (i + 1) % 100 == 0:
+                cache.flush()
+                print('[INFO] teacher cache : {}/{}'.format(i + 1, len(loader)), flush=True)
+    cache.flush()
+    teacher_model.train(was_training)
@@ -0,0 +1,69 @@
+import queue
+import threading
+import torch
+
+
+class TeacherPipeline:
+    """Iterate over data_loader with the frozen teacher running one step ahead in a worker thread.
+    The worker loads the next batches, moves the inputs to device and runs the teacher on them,
+    while the main thread runs forward/backward of the student on the current batch.
+    Batches are handed over through a bounded queue of depth batches.
+    Yields (batch, teacher_logits), batch as given by data_loader with inputs moved to device.
+    """
+    _end = object()
+
+    def __init__(self, data_loader, teacher_model, device, depth=2):
+        self.data_loader = data_loader
+        self.teacher_model = teacher_model
+        self.device = device
+        self.queue = queue.Queue(maxsize=depth)
+        self.stop = threading.Event()
+        self.worker = None
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            with torch.no_grad():
+                for batch in self.data_loader:
+                    inputs = batch[0].to(self.device, non_blocking=True)
+                    teacher_logits = self.teacher_model(inputs)
+                    if not self._put(((inputs,) + tuple(batch[1:]), teacher_logits)):
+                        return
+        except Exception as e:
+            self._put(e)
+            return
+        self._put(self._end)
+
+    def __iter__(self):
+        self.close()
+        self.stop.clear()
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is self._end:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def close(self):
+        if self.worker is not None:
+            self.stop.set()
+            self.worker.join()
+            self.worker = None
@@ -22,11 +22,13 @@ class TeacherStudentModule(nn.Module):
         # opt.model = 'resnext'
         self.student_model = build_model(opt, opt.model, self.phase)
 
-    def forward(self, x):
+    def forward(self, x, teacher_x=None):
         # x = x.to(self.device)
         # x = x.cuda()
+        # teacher_x : teacher logits of x read from the teacher cache, if None the teacher runs on x
         if self.phase == 'train':
-            teacher_x = self.teacher_model(x)
+            if teacher_x is None:
+                teacher_x = self.teacher_model(x)
             student_x = self.student_model(x)
             out = (teacher_x, student_x)
         else:
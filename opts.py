@@ -31,10 +31,59 @@ def parse_opts():
     parser.add_argument('--loss_type', default='KDloss', help='normal(cross entropy)'
                                                               'KDloss(teacher student loss)')
     parser.add_argument('--candidate', default=False, help='if true, use candidate extraction')
+    parser.add_argument('--candidate_method', default='squeezenet', type=str,
+                        help='Candidate boundary extractor : squeezenet (cosine distance of features) '
+                             '| histogram (HSV histogram and pixel difference, no CNN)')
+    parser.add_argument('--candidate_streaming', action='store_true',
+                        help='If true, candidate extraction decodes frames as a stream (bounded memory, no PCA)')
+    parser.add_argument('--candidate_block_size', default=256, type=int,
+                        help='Number of frames decoded per block in streaming candidate extraction')
+    parser.add_argument('--candidate_batch_size', default=32, type=int,
+                        help='Number of frames per SqueezeNet forward in candidate extraction')
+    parser.add_argument('--decode_size', default=0, type=int,
+                        help='If > 0, squeezenet candidate extraction resizes frames to decode_size x decode_size '
+                             'right after decoding (default : full resolution until the feature extraction)')
+    parser.add_argument('--candidate_step', default=1, type=int,
+                        help='histogram candidate extraction compares only every candidate_step-th frame, '
+                             'the frames in between are skipped by grab() without conversion')
+    parser.add_argument('--candidate_pca', default='full', type=str,
+                        help='PCA of candidate features : full | incremental | reference | none')
+    parser.add_argument('--candidate_pca_path', default='', type=str,
+                        help='PCA basis fitted on a reference corpus, used when candidate_pca == reference '
+                             '(fit_reference_pca, do_fit_pca of lib/candidate_extracting.py)')
+    parser.add_argument('--feature_cache_dir', default='', type=str,
+                        help='Directory of candidate feature cache. if empty, [video dir]/feature_cache')
+    parser.add_argument('--cascade', action='store_true',
+                        help='If true, test runs the 3D detector only on windows around candidate boundaries')
+    parser.add_argument('--cascade_threshold', default=0.2, type=float,
+                        help='Distance to the next frame above which a frame is a candidate boundary '
+                             '(cosine distance for squeezenet, histogram / pixel distance for histogram)')
+    parser.add_argument('--cascade_margin', default=8, type=int,
+                        help='Windows within cascade_margin frames of a candidate boundary are classified')
+    parser.add_argument('--cascade_recall', default=0.95, type=float,
+                        help='Recall target of candidate boundaries, used to calibrate cascade_threshold (eval_res)')
+    parser.add_argument('--frame_store', action='store_true',
+                        help='If true, the cascade decodes each video once into a FrameStore, read by both stages '
+                             '(second stage windows are read from the store instead of the test dataset, RGB only). '
+                             'The store holds every frame at full resolution : frames x H x W x 3 bytes, '
+                             'e.g. about 670 GB for one hour of 1080p at 30 fps')
+    parser.add_argument('--frame_store_dir', default='', type=str,
+                        help='Directory of the frame store memmap (frames.uint8, overwritten by each video and kept '
+                             'after test). if empty, a directory in the system temp dir')
+    parser.add_argument('--merge_policy', default='latest', type=str,
+                        help='Merge of overlapping transitions : latest | cut(cut first) | gradual(gradual first) | '
+                             'origin, multiloss bars always use the multiloss policy except origin')
+    parser.add_argument('--amp', action='store_true',
+                        help='If true, train and test forward run under autocast (bfloat16 on cpu, float16 on cuda)')
+    parser.add_argument('--accumulation_steps', default=1, type=int,
+                        help='Number of iterations whose gradients are accumulated per optimizer step')
     parser.add_argument('--sample_size', default=128, type=int, help='Height and width of inputs')
     parser.add_argument('--sample_duration', default=16, type=int, help='Temporal duration of inputs')
     parser.add_argument('--batch_size', default=8, type=int, help='Batch Size')
     parser.add_argument('--n_threads', default=2, type=int, help='Number of threads for multi-thread loading')
+    parser.add_argument('--prefetch_videos', default=0, type=int,
+                        help='At test, number of videos decoded and preprocessed in worker processes ahead of the '
+                             'video in inference. 0 : videos are loaded one after another')
     parser.add_argument('--use_save_timing', default=False,
                         help='if True, adjust save timing from 2000 to 5000. else, iter_per_epoch / 5')
     parser.add_argument('--shuffle', default=True, help="shuffle the dataset")
@@ -52,6 +52,27 @@ def set_loss_cfg():
         parser.add_argument('--teacher_model_path', default='models/Alexnet-final.pth', type=str,
                             help='Pretrained model (.pth)')
         parser.add_argument('--alexnet_type', default='dropout', type=str, help='origin | dropout')
+        parser.add_argument('--teacher_cache_dir', default='', type=str,
+                            help='Directory of cached teacher logits. if empty, the teacher runs on every batch')
+        parser.add_argument('--teacher_cache_seeds', default=4, type=int,
+                            help='Number of augmentation seeds per training sample in the teacher cache. '
+                                 'The student only sees these num_seeds augmentations of each sample for the whole '
+                                 'run (1 : one fixed crop per sample), while the cache build costs num_seeds '
+                                 'teacher passes over the data')
+        parser.add_argument('--teacher_cache_fallback', action='store_true',
+                            help='If true, batches missing in the teacher cache run the teacher, else raise')
+        parser.add_argument('--teacher_pipeline', action='store_true',
+                            help='If true and no teacher cache, the teacher runs on the next batch in a worker thread')
+        parser.add_argument('--teacher_pipeline_depth', default=2, type=int,
+                            help='Number of batches the teacher may run ahead of the student')
+
+    if loss_type == 'multiloss':
+        parser.add_argument('--nms_threshold', default=0.33, type=float, help='IoU threshold of NMS')
+        parser.add_argument('--nms_policy', default=1, type=int,
+                            help='1 : IoU only | 2 : and start offset != 1 | '
+                                 '3 : and not (start offset == 1 and IoU == 0.5)')
+        parser.add_argument('--nms_mode', default='batched', type=str,
+                            help='batched | sweep(memory linear in overlapping pairs, for very long videos)')
 
 
 def set_optimizer_cfg():